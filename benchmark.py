@@ -0,0 +1,216 @@
+"""Offline benchmark of the weather client.
+
+Replays a cassette recorded with WEATHER_TRANSPORT=record and measures throughput
+and latency of the whole fetch -> parse -> render path without touching the network.
+
+    python benchmark.py weather_cassette.json --iterations 20 --concurrency 8 --latency 0.05
+
+With --footprint it also reports the memory held per cached observation, and with
+--parse the cost of decoding current, bulk and forecast payloads with each
+available JSON decoder. --records compares the packed record format with JSON and
+pickle for size, decoding and scanning one field.
+"""
+import argparse
+import os
+import json
+import time
+import pickle
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from weather_app import (WeatherApp, WeatherData, ReplayTransport, JSON_DECODERS,
+                         RecordCodec, decode_observation, decode_bulk)
+
+def recorded_lookups(cassette_path):
+    """Return the API URL and the single-city queries stored in a cassette"""
+    with open(cassette_path) as cassette:
+        interactions = json.load(cassette)['interactions']
+    base_url = None
+    cities = []
+    for interaction in interactions:
+        # Revalidations carry a fifth element with their conditional headers
+        method, url, params, body = json.loads(interaction['key'])[:4]
+        city = params.get('q')
+        if method == "GET" and city and city != 'bulk' and city not in cities:
+            base_url = url
+            cities.append(city)
+    return base_url, cities
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_fetch_benchmark(app, cities, iterations, concurrency):
+    """Time fetch -> parse -> render for every city, `iterations` times over"""
+    def timed_lookup(city):
+        start = time.perf_counter()
+        weather = app.fetch_weather(city)
+        str(weather)  # render
+        return time.perf_counter() - start
+    
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(iterations):
+            # Start every round cold so each lookup runs the full path
+            app.clear_cache()
+            futures = [executor.submit(timed_lookup, city) for city in cities]
+            for future in futures:
+                try:
+                    latencies.append(future.result())
+                except Exception:
+                    errors += 1
+    total = time.perf_counter() - start
+    return latencies, errors, total
+
+def sample_observations(count):
+    return [
+        WeatherData(f"City {i % 50}", "United Kingdom", 12.5, 11.0, "Partly cloudy", 81,
+                    4.2, 1700000000 + i, "https://cdn.weatherapi.com/weather/64x64/day/116.png")
+        for i in range(count)
+    ]
+
+def measure_footprint(count=100000):
+    """Return the bytes allocated per WeatherData for `count` observations across 50 cities"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    observations = sample_observations(count)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(observations)
+
+def sample_payloads():
+    """Return (current, bulk, forecast) response bodies shaped like WeatherAPI's"""
+    location = {
+        "name": "London", "region": "City of London, Greater London", "country": "United Kingdom",
+        "lat": 51.52, "lon": -0.11, "tz_id": "Europe/London",
+        "localtime_epoch": 1700000000, "localtime": "2023-11-14 22:13",
+    }
+    condition = {"text": "Partly cloudy", "icon": "//cdn.weatherapi.com/weather/64x64/night/116.png", "code": 1003}
+    current = {
+        "last_updated_epoch": 1700000000, "last_updated": "2023-11-14 22:00",
+        "temp_c": 9.0, "temp_f": 48.2, "is_day": 0, "condition": condition,
+        "wind_mph": 8.1, "wind_kph": 13.0, "wind_degree": 230, "wind_dir": "SW",
+        "pressure_mb": 1008.0, "pressure_in": 29.77, "precip_mm": 0.0, "precip_in": 0.0,
+        "humidity": 87, "cloud": 50, "feelslike_c": 6.9, "feelslike_f": 44.4,
+        "vis_km": 10.0, "vis_miles": 6.0, "uv": 1.0, "gust_mph": 12.7, "gust_kph": 20.5,
+    }
+    hour = dict(current, time_epoch=1700000000, time="2023-11-14 00:00", chance_of_rain=20,
+                chance_of_snow=0, will_it_rain=0, will_it_snow=0, dewpoint_c=6.8, heatindex_c=9.0)
+    day = {
+        "date": "2023-11-14", "date_epoch": 1699920000,
+        "day": {"maxtemp_c": 11.2, "mintemp_c": 7.4, "avgtemp_c": 9.3, "condition": condition,
+                "totalprecip_mm": 2.1, "avghumidity": 84, "uv": 2.0},
+        "astro": {"sunrise": "07:14 AM", "sunset": "04:17 PM", "moon_phase": "New Moon"},
+        "hour": [hour] * 24,
+    }
+    bulk = {"bulk": [{"query": {"custom_id": str(i), "q": f"City {i}", "location": location,
+                                "current": current}} for i in range(50)]}
+    return (json.dumps({"location": location, "current": current}).encode(),
+            json.dumps(bulk).encode(),
+            json.dumps({"location": location, "current": current,
+                        "forecast": {"forecastday": [day] * 3}}).encode())
+
+def measure_parse_cost(iterations=2000):
+    """Return {payload: {decoder: microseconds per response}} for each sample payload"""
+    current, bulk, forecast = sample_payloads()
+    cases = [('current', current, decode_observation),
+             ('bulk (50)', bulk, decode_bulk),
+             ('forecast (3 days)', forecast, decode_observation)]
+    costs = {}
+    for name, payload, decode in cases:
+        costs[name] = {}
+        for decoder in JSON_DECODERS:
+            count = max(1, iterations // 50) if decode is decode_bulk else iterations
+            start = time.perf_counter()
+            for _ in range(count):
+                decode(payload, decoder)
+            costs[name][decoder] = (time.perf_counter() - start) / count * 1e6
+    return costs
+
+def measure_record_formats(count=100000):
+    """Return {format: (bytes per record, decode us per record, scan us per record)}.
+    
+    Scanning reads every temperature, the typical archive query.
+    """
+    observations = sample_observations(count)
+    fields = ('city', 'country', 'temperature', 'feels_like', 'description', 'humidity',
+              'wind_speed', 'timestamp', 'icon_url')
+    
+    def timed(func):
+        start = time.perf_counter()
+        result = func()
+        return result, (time.perf_counter() - start) / count * 1e6
+    
+    def packed(func):
+        codec, records = RecordCodec.loads(blob)
+        return func(codec, records)
+    
+    blob = RecordCodec().dumps(observations)
+    _, packed_decode = timed(lambda: packed(lambda codec, records: codec.unpack_many(records)))
+    _, packed_scan = timed(lambda: packed(lambda codec, records: codec.column(records, 'temperature')))
+    
+    json_blob = json.dumps([[getattr(weather, field) for field in fields] for weather in observations]).encode()
+    _, json_decode = timed(lambda: [WeatherData(*row) for row in json.loads(json_blob)])
+    _, json_scan = timed(lambda: [row[2] for row in json.loads(json_blob)])
+    
+    pickle_blob = pickle.dumps(observations, protocol=pickle.HIGHEST_PROTOCOL)
+    _, pickle_decode = timed(lambda: pickle.loads(pickle_blob))
+    _, pickle_scan = timed(lambda: [weather.temperature for weather in pickle.loads(pickle_blob)])
+    
+    return {
+        'packed': (len(blob) / count, packed_decode, packed_scan),
+        'json': (len(json_blob) / count, json_decode, json_scan),
+        'pickle': (len(pickle_blob) / count, pickle_decode, pickle_scan),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a cassette and benchmark the weather client")
+    parser.add_argument("cassette", nargs="?", help="cassette file recorded with WEATHER_TRANSPORT=record")
+    parser.add_argument("--iterations", type=int, default=10, help="rounds over every recorded city")
+    parser.add_argument("--concurrency", type=int, default=1, help="lookups in flight at once")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated network latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency up to (s)")
+    parser.add_argument("--footprint", action="store_true", help="also measure memory per observation")
+    parser.add_argument("--parse", action="store_true", help="also measure JSON decode cost per response")
+    parser.add_argument("--records", action="store_true", help="also compare observation storage formats")
+    args = parser.parse_args()
+    
+    if args.parse:
+        for name, costs in measure_parse_cost().items():
+            timings = ", ".join(f"{decoder} {cost:.1f} us" for decoder, cost in costs.items())
+            print(f"Parse {name}: {timings}")
+    if args.footprint:
+        print(f"Footprint:   {measure_footprint():.0f} bytes per observation")
+    if args.records:
+        for name, (size, decode, scan) in measure_record_formats().items():
+            print(f"Records {name}: {size:.0f} bytes, decode {decode:.2f} us, scan {scan:.3f} us per record")
+    if args.cassette is None:
+        return
+    
+    # Replay never sends the key anywhere, but WeatherApp requires one
+    os.environ.setdefault("WEATHER_API_KEY", "replay")
+    transport = ReplayTransport(args.cassette, args.latency, args.jitter, seed=0)
+    # Isolated from the user's settings: no shared rate limit buckets to drain, no
+    # warm-up racing the first round, and no persistent cache to read or overwrite
+    app = WeatherApp(transport=transport, max_attempts=1, rate_limits=[], watchlist=[],
+                     persistent_cache=False)
+    
+    base_url, cities = recorded_lookups(args.cassette)
+    if not cities:
+        print("No single-city lookups found in the cassette.")
+        return
+    app.base_url = base_url
+    
+    latencies, errors, total = run_fetch_benchmark(app, cities, args.iterations, args.concurrency)
+    latencies.sort()
+    print(f"Lookups:     {len(latencies)} ok, {errors} failed, {len(cities)} distinct cities")
+    print(f"Throughput:  {len(latencies) / total:.1f} lookups/s")
+    if latencies:
+        print(f"Latency p50: {percentile(latencies, 0.50) * 1000:.2f} ms")
+        print(f"Latency p95: {percentile(latencies, 0.95) * 1000:.2f} ms")
+        print(f"Latency p99: {percentile(latencies, 0.99) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Build the icon atlas the GUI memory-maps at startup.
+
+Downloads every WeatherAPI condition icon (day and night), resizes it to the sizes
+the GUI displays and packs the PNGs into a single atlas file:
+
+    python build_icon_atlas.py
+    python build_icon_atlas.py --source weather_icons/ --output weather_icons.atlas
+
+With --source, icons are read from a local copy of WeatherAPI's icon set laid out
+as <source>/day/113.png and <source>/night/113.png instead of being downloaded.
+"""
+import argparse
+import io
+import os
+
+import requests
+from PIL import Image
+
+from weather_app import PooledSession
+from weather_app_gui import IconAtlas, WeatherAppGUI
+
+ICON_URL = "https://cdn.weatherapi.com/weather/64x64/{time_of_day}/{code}.png"
+
+# Icon codes used by WeatherAPI condition icons
+ICON_CODES = [
+    113, 116, 119, 122, 143, 176, 179, 182, 185, 200, 227, 230, 248, 260, 263, 266,
+    281, 284, 293, 296, 299, 302, 305, 308, 311, 314, 317, 320, 323, 326, 329, 332,
+    335, 338, 350, 353, 356, 359, 362, 365, 368, 371, 374, 377, 386, 389, 392, 395,
+]
+
+def parse_size(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height or width)
+
+def load_icon(session, source, time_of_day, code):
+    """Return the original icon bytes from the local source folder or the CDN"""
+    if source:
+        with open(os.path.join(source, time_of_day, f"{code}.png"), "rb") as icon_file:
+            return icon_file.read()
+    response = session.get(ICON_URL.format(time_of_day=time_of_day, code=code), timeout=(3.05, 10))
+    response.raise_for_status()
+    return response.content
+
+def main():
+    default_size = "{}x{}".format(*WeatherAppGUI.ICON_SIZE)
+    parser = argparse.ArgumentParser(description="Pack WeatherAPI condition icons into an atlas file")
+    parser.add_argument("--output", default="weather_icons.atlas", help="atlas file to write")
+    parser.add_argument("--source", help="local icon folder with day/ and night/ subfolders")
+    parser.add_argument("--sizes", nargs="+", default=[default_size],
+                        help=f"icon sizes to include, e.g. 100x100 (default {default_size})")
+    args = parser.parse_args()
+    sizes = [parse_size(size) for size in args.sizes]
+    
+    session = PooledSession()
+    icons = {}
+    missing = 0
+    for time_of_day in ("day", "night"):
+        for code in ICON_CODES:
+            try:
+                original = Image.open(io.BytesIO(load_icon(session, args.source, time_of_day, code)))
+            except (OSError, requests.exceptions.RequestException) as err:
+                print(f"Skipping {time_of_day}/{code}: {err}")
+                missing += 1
+                continue
+            for size in sizes:
+                buffer = io.BytesIO()
+                original.resize(size, Image.LANCZOS).save(buffer, format="PNG")
+                icons[IconAtlas.key(time_of_day, code, size)] = buffer.getvalue()
+    session.close()
+    
+    IconAtlas.write(args.output, icons)
+    print(f"Wrote {len(icons)} icons ({missing} missing) to {args.output} "
+          f"({os.path.getsize(args.output)} bytes)")
+
+if __name__ == "__main__":
+    main()
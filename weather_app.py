@@ -1,45 +1,1852 @@
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import os
 import json
-from datetime import datetime
+import base64
+import sqlite3
+import hashlib
+import re
+import sys
+import math
+import struct
+from http.client import responses as HTTP_REASONS
+from datetime import datetime, timedelta
 import time
+import threading
+import random
+import tempfile
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import asyncio
+from array import array
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:
+    # No file locking (e.g. Windows): rate limits are then enforced per process only
+    fcntl = None
+
+try:
+    # urllib3 decodes brotli responses when one of these packages is installed
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        import brotlicffi  # noqa: F401
+    ACCEPT_ENCODING = "br, gzip, deflate"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Optional faster JSON decoders, best first; the standard library is the fallback
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Load environment variables from .env file
 load_dotenv()
 
 class WeatherData:
-    """Class to store and represent weather data"""
-    def __init__(self, city, country, temp, feels_like, description, humidity, wind_speed, timestamp):
-        self.city = city
-        self.country = country
-        self.temperature = temp
-        self.feels_like = feels_like
-        self.description = description
-        self.humidity = humidity
-        self.wind_speed = wind_speed
-        self.timestamp = timestamp
+    """Class to store and represent weather data.
+    
+    Used by both the CLI and the GUI, and held in large numbers by the caches, so it
+    is kept compact: fixed slots instead of a per-instance __dict__, numbers stored
+    as float/int, and repeated strings (countries, conditions, icon URLs) interned so
+    observations share one copy. The text from __str__ is built on first use only.
+    
+    The raw response bytes can be kept alongside (as a memoryview); the less used
+    fields (pressure, UV, gusts, visibility, precipitation, air quality) are only
+    decoded from them the first time one of them is read.
+    """
+    __slots__ = ('city', 'country', 'temperature', 'feels_like', 'description',
+                 'humidity', 'wind_speed', 'timestamp', 'icon_url', 'raw', '_text', '_extras')
+    
+    def __init__(self, city, country, temp, feels_like, description, humidity, wind_speed, timestamp,
+                 icon_url=None, raw=None):
+        self.city = sys.intern(city)
+        self.country = sys.intern(country)
+        self.temperature = float(temp)
+        self.feels_like = float(feels_like)
+        self.description = sys.intern(description)
+        self.humidity = int(humidity)
+        self.wind_speed = float(wind_speed)
+        self.timestamp = int(timestamp)
+        self.icon_url = sys.intern(icon_url) if icon_url else None
+        self.raw = memoryview(raw) if raw is not None else None
+        self._text = None
+        self._extras = None
         
     def __str__(self):
         """String representation of the weather data"""
-        date_time = datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        
-        return f"""
+        if self._text is None:
+            date_time = datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+            
+            self._text = f"""
 Weather in {self.city}, {self.country} at {date_time}:
 Temperature: {self.temperature}°C (Feels like: {self.feels_like}°C)
 Conditions: {self.description}
 Humidity: {self.humidity}%
 Wind Speed: {self.wind_speed:.1f} m/s
 """
+        return self._text
+    
+    def extras(self):
+        """Return the extra fields decoded from the raw response (empty without one)"""
+        if self._extras is None:
+            self._extras = decode_extras(self.raw) if self.raw is not None else {}
+        return self._extras
+    
+    @property
+    def pressure(self):
+        """Air pressure in millibars, or None"""
+        return self.extras().get('pressure_mb')
+    
+    @property
+    def uv(self):
+        return self.extras().get('uv')
+    
+    @property
+    def gust_speed(self):
+        """Wind gusts in m/s, or None"""
+        gust_kph = self.extras().get('gust_kph')
+        return gust_kph / 3.6 if gust_kph is not None else None
+    
+    @property
+    def visibility(self):
+        """Visibility in km, or None"""
+        return self.extras().get('vis_km')
+    
+    @property
+    def precipitation(self):
+        """Precipitation in mm, or None"""
+        return self.extras().get('precip_mm')
+    
+    @property
+    def air_quality(self):
+        """Pollutant readings (only present when requested with aqi=yes), or None"""
+        return self.extras().get('air_quality')
 
-class WeatherApp:
+class StringTable:
+    """Interned strings addressed by small integer ids; id 0 stands for None"""
+    def __init__(self, strings=None):
+        self._strings = [None]
+        self._ids = {None: 0}
+        for value in strings or ():
+            self.id_for(value)
+    
+    def id_for(self, value):
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = self._ids[value] = len(self._strings)
+            self._strings.append(value)
+        return string_id
+    
+    def __getitem__(self, string_id):
+        return self._strings[string_id]
+    
+    def __len__(self):
+        return len(self._strings)
+    
+    def to_list(self):
+        """Every string in id order, without the None placeholder"""
+        return self._strings[1:]
+
+class RecordCodec:
+    """Fixed-width binary encoding of WeatherData.
+    
+    Each observation packs into RECORD.size (49) bytes: the numeric fields as
+    little-endian doubles and ints, and city, country, condition and icon URL as ids
+    into a StringTable. Records can be packed into and read from any buffer, and a
+    single field can be scanned across a buffer of records without decoding the rest.
+    
+    dumps()/loads() add a header and the string table, giving a self-contained blob
+    for archives or for handing observations to another process:
+    MAGIC, uint32 string table length, uint32 record count, JSON string list, records.
+    """
+    RECORD = struct.Struct("<dddqBIIII")
+    FIELDS = ('temperature', 'feels_like', 'wind_speed', 'timestamp', 'humidity',
+              'city_id', 'country_id', 'description_id', 'icon_id')
+    MAGIC = b"WXRECRD1"
+    _HEADER = struct.Struct("<8sII")
+    
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else StringTable()
+        self._columns = {}
+    
+    def pack_into(self, buffer, offset, weather):
+        strings = self.strings
+        self.RECORD.pack_into(buffer, offset, weather.temperature, weather.feels_like,
+                              weather.wind_speed, weather.timestamp, weather.humidity,
+                              strings.id_for(weather.city), strings.id_for(weather.country),
+                              strings.id_for(weather.description), strings.id_for(weather.icon_url))
+    
+    def pack_many(self, observations):
+        """Return a bytearray holding every observation as one record"""
+        size = self.RECORD.size
+        buffer = bytearray(size * len(observations))
+        for i, weather in enumerate(observations):
+            self.pack_into(buffer, i * size, weather)
+        return buffer
+    
+    def _weather(self, values):
+        temperature, feels_like, wind_speed, timestamp, humidity, city, country, description, icon = values
+        strings = self.strings
+        return WeatherData(strings[city], strings[country], temperature, feels_like,
+                           strings[description], humidity, wind_speed, timestamp, strings[icon])
+    
+    def unpack_from(self, buffer, offset=0):
+        return self._weather(self.RECORD.unpack_from(buffer, offset))
+    
+    def unpack_many(self, buffer):
+        """Return the WeatherData for every record in `buffer`"""
+        return [self._weather(values) for values in self.RECORD.iter_unpack(buffer)]
+    
+    def column(self, buffer, name):
+        """Return one field of every record in `buffer` as an array"""
+        scanner = self._columns.get(name)
+        if scanner is None:
+            # Skip the bytes before and after the field, so struct does the scan in C
+            index = self.FIELDS.index(name)
+            code = self.RECORD.format.lstrip("<")[index]
+            offset = struct.calcsize("<" + self.RECORD.format.lstrip("<")[:index])
+            width = struct.calcsize("<" + code)
+            scanner = self._columns[name] = (
+                struct.Struct(f"<{offset}x{code}{self.RECORD.size - offset - width}x"), code)
+        record, code = scanner
+        return array(code, (values[0] for values in record.iter_unpack(buffer)))
+    
+    def dumps(self, observations):
+        return self.wrap(self.pack_many(observations))
+    
+    def wrap(self, records):
+        """Prefix packed records with the header and this codec's string table"""
+        strings = json.dumps(self.strings.to_list()).encode("utf-8")
+        count = len(records) // self.RECORD.size
+        return self._HEADER.pack(self.MAGIC, len(strings), count) + strings + records
+    
+    @classmethod
+    def loads(cls, data):
+        """Return (codec, buffer of records) from a blob written by dumps().
+        
+        Raises ValueError if the blob is truncated or refers to strings it lacks.
+        """
+        if len(data) < cls._HEADER.size:
+            raise ValueError("truncated packed observation blob")
+        magic, strings_length, count = cls._HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC:
+            raise ValueError("not a packed observation blob")
+        start = cls._HEADER.size
+        end = start + strings_length + count * cls.RECORD.size
+        if len(data) < end:
+            raise ValueError("truncated packed observation blob")
+        strings = json.loads(bytes(data[start:start + strings_length]).decode("utf-8"))
+        if not isinstance(strings, list) or not all(isinstance(value, str) for value in strings):
+            raise ValueError("corrupt string table in packed observation blob")
+        codec = cls(StringTable(strings))
+        records = memoryview(data)[start + strings_length:end]
+        for name in ('city_id', 'country_id', 'description_id', 'icon_id'):
+            ids = codec.column(records, name)
+            if ids and max(ids) >= len(codec.strings):
+                raise ValueError("packed observation blob refers to a missing string")
+            # Only the icon URL may be None (id 0)
+            if ids and name != 'icon_id' and min(ids) == 0:
+                raise ValueError(f"packed observation blob lacks a required string ({name})")
+        return codec, records
+
+class HistoryStore:
+    """Fixed-capacity ring buffer of observations stored column by column.
+    
+    Numbers live in preallocated typed arrays and strings are replaced by ids into
+    a shared table, so each observation costs a few dozen bytes and appending never
+    shifts or allocates. Once full, each append overwrites the oldest observation.
+    """
+    def __init__(self, capacity=10000):
+        if capacity < 1:
+            raise ValueError(f"History capacity must be at least 1, got {capacity}")
+        self.capacity = capacity
+        self.temperature = array('d', bytes(8 * capacity))
+        self.feels_like = array('d', bytes(8 * capacity))
+        self.wind_speed = array('d', bytes(8 * capacity))
+        self.humidity = array('B', bytes(capacity))
+        self.timestamp = array('q', bytes(8 * capacity))
+        self.city_id = array('I', bytes(4 * capacity))
+        self.country_id = array('I', bytes(4 * capacity))
+        self.description_id = array('I', bytes(4 * capacity))
+        self.icon_id = array('I', bytes(4 * capacity))
+        self.strings = StringTable()
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+    
+    def append(self, weather):
+        with self._lock:
+            i = self._next
+            self.temperature[i] = weather.temperature
+            self.feels_like[i] = weather.feels_like
+            self.wind_speed[i] = weather.wind_speed
+            self.humidity[i] = weather.humidity
+            self.timestamp[i] = weather.timestamp
+            self.city_id[i] = self.strings.id_for(weather.city)
+            self.country_id[i] = self.strings.id_for(weather.country)
+            self.description_id[i] = self.strings.id_for(weather.description)
+            self.icon_id[i] = self.strings.id_for(weather.icon_url)
+            self._next = (i + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+    
+    def __len__(self):
+        return self._count
+    
+    def _row(self, i):
+        strings = self.strings
+        return WeatherData(strings[self.city_id[i]], strings[self.country_id[i]],
+                           self.temperature[i], self.feels_like[i],
+                           strings[self.description_id[i]], self.humidity[i],
+                           self.wind_speed[i], self.timestamp[i], strings[self.icon_id[i]])
+    
+    def recent(self, limit=None):
+        """Return up to `limit` observations as WeatherData, newest first"""
+        with self._lock:
+            count = self._count if limit is None else min(limit, self._count)
+            return [self._row((self._next - 1 - n) % self.capacity) for n in range(count)]
+    
+    def column(self, name):
+        """Return a copy of one numeric column in chronological order (oldest first)"""
+        with self._lock:
+            values = getattr(self, name)
+            if self._count < self.capacity:
+                return values[:self._count]
+            return values[self._next:] + values[:self._next]
+    
+    def summary(self, since=None):
+        """Return count and min/max/mean temperature of observations updated at or after `since`"""
+        temperatures = self.column('temperature')
+        if since is not None:
+            # Observations are appended roughly in time order, but check every one
+            timestamps = self.column('timestamp')
+            temperatures = array('d', (t for t, ts in zip(temperatures, timestamps) if ts >= since))
+        if not temperatures:
+            return {'count': 0, 'min': None, 'max': None, 'mean': None}
+        return {
+            'count': len(temperatures),
+            'min': min(temperatures),
+            'max': max(temperatures),
+            'mean': math.fsum(temperatures) / len(temperatures),
+        }
+    
+    def dumps(self):
+        """Return every observation, oldest first, as a RecordCodec blob"""
+        codec = RecordCodec(self.strings)
+        size = codec.RECORD.size
+        with self._lock:
+            records = bytearray(size * self._count)
+            start = self._next - self._count
+            for n in range(self._count):
+                i = (start + n) % self.capacity
+                # Ids already index this store's string table, so rows pack as they are
+                codec.RECORD.pack_into(records, n * size, self.temperature[i], self.feels_like[i],
+                                       self.wind_speed[i], self.timestamp[i], self.humidity[i],
+                                       self.city_id[i], self.country_id[i],
+                                       self.description_id[i], self.icon_id[i])
+            return codec.wrap(records)
+    
+    def extend(self, data):
+        """Append every observation from a RecordCodec blob (e.g. a saved history)"""
+        codec, records = RecordCodec.loads(data)
+        # Decode everything first, so a bad blob leaves the history untouched
+        observations = codec.unpack_many(records)
+        for weather in observations:
+            self.append(weather)
+    
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+# WeatherAPI error code for "No location found matching parameter 'q'"
+LOCATION_NOT_FOUND = 1006
+
+class WeatherServiceError(Exception):
+    """Error reported by the weather service for a single location"""
+    def __init__(self, code, message):
+        super().__init__(f"{message} (code {code})")
+        self.code = code
+        self.message = message
+
+class Deadline:
+    """Overall time budget shared by every request made for one operation"""
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+    
+    def remaining(self):
+        """Seconds left in the budget (never negative)"""
+        return max(0.0, self.expires_at - time.monotonic())
+    
+    def expired(self):
+        return self.remaining() <= 0
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without contacting the service while its circuit breaker is open"""
+
+class RetryPolicy:
+    """Capped exponential backoff with full jitter for transient failures"""
+    # Rate limiting and server-side errors that are worth trying again
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def backoff(self, attempt):
+        """Random delay before retry number `attempt` (1-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+    
+    def delay_for(self, attempt, response=None):
+        """Delay before the next attempt, honoring the server's Retry-After header.
+        
+        Returns None if the server asks us to wait longer than `max_delay`, meaning
+        the caller should give up rather than block for that long.
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            delay = None
+            try:
+                delay = max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    # Retry-After may also be an HTTP date
+                    delay = max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+            if delay is not None:
+                return delay if delay <= self.max_delay else None
+        return self.backoff(attempt)
+
+class CircuitBreaker:
+    """Fail fast while an upstream host keeps failing.
+    
+    After `failure_threshold` consecutive failures the breaker opens and rejects
+    calls for `reset_timeout` seconds, then lets a single probe call through
+    (half-open) to decide whether to close again.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        """Return True if a call may be made now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+    
+    def release_probe(self):
+        """Give back a half-open probe slot when the call was never made"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+class RateLimitExceeded(requests.exceptions.RequestException):
+    """Raised when a call is shed because the client-side rate limit is exhausted"""
+
+class RateLimiter:
+    """Token-bucket rate limiter shared by threads and, via a locked state file, by processes.
+    
+    `limits` is a list of (calls, period_seconds) pairs; a call needs a token from every
+    bucket. In "wait" mode callers queue until a token is free (for at most their
+    deadline, or `max_wait` seconds without one), in "shed" mode they get
+    RateLimitExceeded immediately. If the state file cannot be opened, limits are
+    enforced for this process only.
+    """
+    def __init__(self, limits, state_file=None, mode="wait", max_wait=30.0):
+        self.limits = limits
+        self.state_file = os.path.expanduser(state_file) if state_file else None
+        self.mode = mode
+        self.max_wait = max_wait
+        self._state = {}
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.shed = 0
+    
+    def _take_token(self, state):
+        """Refill the buckets in `state` and take a token; return seconds to wait if none is free"""
+        now = time.time()
+        wait = 0.0
+        levels = {}
+        for calls, period in self.limits:
+            key = f"{calls}/{period}"
+            tokens, updated = state.get(key, (calls, now))
+            rate = calls / period
+            tokens = min(calls, tokens + max(0.0, now - updated) * rate)
+            levels[key] = tokens
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+        # Only spend tokens when every bucket has one, so a queued call costs nothing
+        for key, tokens in levels.items():
+            state[key] = [tokens - 1 if wait == 0 else tokens, now]
+        return wait
+    
+    def _open_state_file(self):
+        """Open the shared state file, or return None if it cannot be used"""
+        # Never follow a symlink planted in place of the file
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0)
+        try:
+            directory = os.path.dirname(os.path.abspath(self.state_file))
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            return os.fdopen(os.open(self.state_file, flags, 0o600), "r+")
+        except OSError:
+            return None
+    
+    def _try_acquire(self):
+        with self._lock:
+            state_file = None
+            if self.state_file is not None and fcntl is not None:
+                state_file = self._open_state_file()
+            if state_file is None:
+                return self._take_token(self._state)
+            with state_file:
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    try:
+                        state = json.loads(state_file.read() or "{}")
+                    except json.JSONDecodeError:
+                        state = {}
+                    wait = self._take_token(state)
+                    state_file.seek(0)
+                    state_file.truncate()
+                    json.dump(state, state_file)
+                    state_file.flush()
+                finally:
+                    fcntl.flock(state_file, fcntl.LOCK_UN)
+            return wait
+    
+    def acquire(self, deadline=None):
+        """Take a token, waiting (within the deadline) or shedding according to the mode"""
+        if deadline is None:
+            deadline = Deadline(self.max_wait)
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return
+            if self.mode == "shed" or wait >= deadline.remaining():
+                with self._lock:
+                    self.shed += 1
+                raise RateLimitExceeded(f"Client-side rate limit reached; next call allowed in {wait:.1f}s")
+            with self._lock:
+                self.waits += 1
+            time.sleep(wait)
+
+def header_freshness(headers):
+    """Read caching rules from response headers.
+    
+    Returns (storable, lifetime): storable is False for no-store, lifetime is the
+    number of seconds the response may be reused without revalidating (0 for
+    no-cache), or None when the headers say nothing about freshness. Follows
+    Cache-Control max-age minus Age and falls back to Expires.
+    """
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives:
+        return False, None
+    if 'no-cache' in directives:
+        return True, 0.0
+    try:
+        age = float(headers.get('Age') or 0)
+        if 'max-age' in directives:
+            return True, max(0.0, float(directives['max-age']) - age)
+    except ValueError:
+        return True, 0.0
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            return True, max(0.0, parsedate_to_datetime(expires).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return True, 0.0
+    return True, None
+
+def approximate_size(obj):
+    """Rough memory footprint in bytes of an object plus the values it directly holds"""
+    if isinstance(obj, dict):
+        values = list(obj.keys()) + list(obj.values())
+    else:
+        values = list(getattr(obj, '__dict__', {}).values())
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if name != '__dict__' and hasattr(obj, name):
+                    values.append(getattr(obj, name))
+    size = sys.getsizeof(obj)
+    for value in values:
+        size += sys.getsizeof(value)
+        if isinstance(value, memoryview):
+            size += value.nbytes
+    return size
+
+class MemoryBudget:
+    """Global byte budget shared by in-memory caches.
+    
+    Caches register themselves and charge the approximate size of every entry they
+    hold. When the total goes over `max_bytes`, the budget asks the cache that just
+    grew, then the others, to evict their least recently used entries until the
+    total fits again.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._caches = []
+        self._lock = threading.Lock()
+    
+    def register(self, cache):
+        with self._lock:
+            self._caches.append(cache)
+    
+    def charge(self, nbytes):
+        with self._lock:
+            self.used_bytes += nbytes
+    
+    def release(self, nbytes):
+        with self._lock:
+            self.used_bytes -= nbytes
+    
+    def reclaim(self, requester):
+        """Evict entries until usage fits the budget (call without holding any cache lock)"""
+        while self.used_bytes > self.max_bytes:
+            caches = [requester] + [cache for cache in self._caches if cache is not requester]
+            if not any(cache.evict_one('budget') for cache in caches):
+                break
+    
+    def stats(self):
+        return {
+            'max_bytes': self.max_bytes,
+            'used_bytes': self.used_bytes,
+            'occupancy': self.used_bytes / self.max_bytes if self.max_bytes else 0.0,
+            'caches': {cache.name: cache.stats() for cache in self._caches},
+        }
+
+class ResultCache:
+    """Thread-safe LRU cache of WeatherData that expires with WeatherAPI's update cadence.
+    
+    Current conditions are refreshed upstream roughly every `update_interval` seconds,
+    so an observation last updated at T stays fresh until T + update_interval, capped
+    at `max_ttl` seconds from now and never less than `min_ttl` (for late updates).
+    Observations more than `max_age` seconds old are not a late update but old data
+    (e.g. replayed from a cassette), so they get no fresh lifetime at all.
+    Stale entries are kept until evicted so their validators can be used for
+    conditional requests. With a MemoryBudget, entry sizes count against it.
+    """
+    name = "results"
+    
+    def __init__(self, max_entries=500, update_interval=900, max_ttl=900, min_ttl=60, max_age=3600,
+                 budget=None):
+        self.max_entries = max_entries
+        self.update_interval = update_interval
+        self.max_ttl = max_ttl
+        self.min_ttl = min_ttl
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.expirations = 0
+        self.evictions = {'capacity': 0, 'budget': 0}
+        self.bytes = 0
+        self.budget = budget
+        if budget is not None:
+            budget.register(self)
+    
+    def _account(self, nbytes):
+        """Track bytes held (negative to release); caller holds the lock"""
+        self.bytes += nbytes
+        if self.budget is not None:
+            if nbytes >= 0:
+                self.budget.charge(nbytes)
+            else:
+                self.budget.release(-nbytes)
+    
+    def lifetime_for(self, weather, header_lifetime=None):
+        """Seconds `weather` stays fresh, optionally limited by the response headers"""
+        now = time.time()
+        if now - weather.timestamp > self.max_age:
+            return 0.0
+        lifetime = weather.timestamp + self.update_interval - now
+        lifetime = min(self.max_ttl, max(self.min_ttl, lifetime))
+        if header_lifetime is not None:
+            lifetime = min(lifetime, header_lifetime)
+        return lifetime
+    
+    def get(self, key):
+        """Return the fresh WeatherData stored under `key`, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() >= entry['expires_at']:
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['weather']
+    
+    def get_stale(self, key, max_staleness):
+        """Return (weather, is_stale) for an entry at most `max_staleness` seconds past expiry, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            staleness = time.time() - entry['expires_at']
+            if staleness > max_staleness:
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if staleness >= 0:
+                self.stale_hits += 1
+                return entry['weather'], True
+            self.hits += 1
+            return entry['weather'], False
+    
+    def peek(self, key):
+        """Return the entry stored under `key`, fresh or stale, without touching counters"""
+        with self._lock:
+            return self._entries.get(key)
+    
+    def put(self, key, weather, lifetime, etag=None, last_modified=None):
+        entry = {
+            'weather': weather,
+            'etag': etag,
+            'last_modified': last_modified,
+            'expires_at': time.time() + lifetime,
+        }
+        entry['size'] = approximate_size(entry) + approximate_size(weather) + sys.getsizeof(key)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._account(-previous['size'])
+            self._entries[key] = entry
+            self._account(entry['size'])
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest('capacity')
+        if self.budget is not None:
+            self.budget.reclaim(self)
+    
+    def _evict_oldest(self, reason):
+        """Drop the least recently used entry; caller holds the lock"""
+        key, entry = self._entries.popitem(last=False)
+        self._account(-entry['size'])
+        self.evictions[reason] += 1
+    
+    def evict_one(self, reason):
+        """Evict the least recently used entry; return False if the cache is empty"""
+        with self._lock:
+            if not self._entries:
+                return False
+            self._evict_oldest(reason)
+            return True
+    
+    def refresh(self, key, lifetime):
+        """Extend the lifetime of an entry the server confirmed is unchanged"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['expires_at'] = time.time() + lifetime
+                self._entries.move_to_end(key)
+    
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._account(-entry['size'])
+    
+    def clear(self):
+        with self._lock:
+            self._account(-self.bytes)
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'expirations': self.expirations,
+                'evictions': dict(self.evictions),
+            }
+
+class DiskCache:
+    """Persistent SQLite (WAL mode) store of parsed observations and their raw responses.
+    
+    Lets short-lived runs (cron jobs, scripts) start with the results earlier runs
+    fetched. Several processes (CLI and GUI instances) may open the same file: WAL lets
+    readers proceed while one writer commits, and writers wait up to `busy_timeout`
+    seconds for each other instead of failing. Holds at most `max_entries` rows;
+    expired rows are dropped once they are `stale_grace` seconds old, and freed pages
+    are returned with incremental vacuum.
+    
+    The cache is only an optimization: opening a file that is not usable raises
+    sqlite3.Error, but once open, failed reads count as misses and failed writes are
+    skipped (both are counted in `errors`).
+    """
+    # Writes between pruning passes
+    PRUNE_EVERY = 100
+    
+    def __init__(self, path, max_entries=5000, stale_grace=86400, busy_timeout=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.stale_grace = stale_grace
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False,
+                                     isolation_level=None)
+        try:
+            self._create_tables()
+        except sqlite3.Error:
+            self._conn.close()
+            raise
+        self.prune()
+    
+    def _create_tables(self):
+        with self._lock:
+            # auto_vacuum only takes effect if set before the first table is created
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS observations (
+                    key TEXT PRIMARY KEY,
+                    city TEXT, country TEXT, temperature REAL, feels_like REAL,
+                    description TEXT, humidity REAL, wind_speed REAL, timestamp INTEGER,
+                    icon_url TEXT,
+                    raw BLOB,
+                    etag TEXT, last_modified TEXT,
+                    expires_at REAL, stored_at REAL
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS aliases (query TEXT PRIMARY KEY, canonical TEXT)""")
+    
+    def _failed(self):
+        with self._lock:
+            self.errors += 1
+    
+    def load(self):
+        """Return (key, WeatherData, expires_at, etag, last_modified) for every unexpired row"""
+        try:
+            with self._lock:
+                rows = self._conn.execute("""
+                    SELECT key, city, country, temperature, feels_like, description, humidity,
+                           wind_speed, timestamp, icon_url, raw, etag, last_modified, expires_at
+                    FROM observations WHERE expires_at > ? ORDER BY stored_at""", (time.time(),)).fetchall()
+            return [(row[0], WeatherData(*row[1:11]), row[13], row[11], row[12]) for row in rows]
+        except (sqlite3.Error, TypeError, ValueError):
+            self._failed()
+            return []
+    
+    def get(self, key):
+        """Return (WeatherData, expires_at, etag, last_modified) for `key`, or None.
+        
+        Sees rows written by other processes sharing the file.
+        """
+        try:
+            with self._lock:
+                row = self._conn.execute("""
+                    SELECT city, country, temperature, feels_like, description, humidity,
+                           wind_speed, timestamp, icon_url, raw, expires_at, etag, last_modified
+                    FROM observations WHERE key = ?""", (key,)).fetchone()
+            weather = WeatherData(*row[:10]) if row is not None else None
+        except (sqlite3.Error, TypeError, ValueError):
+            # e.g. "database is locked" past the busy timeout: go to the network instead
+            self._failed()
+            weather = None
+        with self._lock:
+            if weather is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return weather, row[10], row[11], row[12]
+    
+    def resolve_alias(self, query_key):
+        """Return the canonical key stored for a normalized query, or None"""
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT canonical FROM aliases WHERE query = ?",
+                                         (query_key,)).fetchone()
+        except sqlite3.Error:
+            self._failed()
+            return None
+        return row[0] if row is not None else None
+    
+    def load_aliases(self):
+        """Return every stored (normalized query, canonical key) pair"""
+        try:
+            with self._lock:
+                return self._conn.execute("SELECT query, canonical FROM aliases").fetchall()
+        except sqlite3.Error:
+            self._failed()
+            return []
+    
+    def put_alias(self, query_key, canonical):
+        try:
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?)", (query_key, canonical))
+        except sqlite3.Error:
+            self._failed()
+    
+    def put(self, key, weather, raw, expires_at, etag=None, last_modified=None):
+        try:
+            with self._lock:
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (key, weather.city, weather.country, weather.temperature, weather.feels_like,
+                     weather.description, weather.humidity, weather.wind_speed, weather.timestamp,
+                     weather.icon_url, raw, etag, last_modified, expires_at, time.time()))
+                self._writes += 1
+                prune = self._writes % self.PRUNE_EVERY == 0
+        except sqlite3.Error:
+            self._failed()
+            return
+        if prune:
+            self.prune()
+    
+    def refresh(self, key, expires_at):
+        try:
+            with self._lock:
+                self._conn.execute("UPDATE observations SET expires_at = ? WHERE key = ?", (expires_at, key))
+        except sqlite3.Error:
+            self._failed()
+    
+    def prune(self):
+        """Drop long-expired rows and the oldest rows over the size cap, then reclaim space"""
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM observations WHERE expires_at < ?",
+                                   (time.time() - self.stale_grace,))
+                self._conn.execute("""
+                    DELETE FROM observations WHERE key IN (
+                        SELECT key FROM observations ORDER BY stored_at DESC LIMIT -1 OFFSET ?)""",
+                    (self.max_entries,))
+                self._conn.execute("PRAGMA incremental_vacuum")
+        except sqlite3.Error:
+            self._failed()
+    
+    def clear(self):
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM observations")
+        except sqlite3.Error:
+            self._failed()
+    
+    def stats(self):
+        try:
+            with self._lock:
+                entries = self._conn.execute("SELECT COUNT(*) FROM observations").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'path': self.path,
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'errors': self.errors,
+            }
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class BloomFilter:
+    """Compact set membership test: may give false positives, never false negatives"""
+    def __init__(self, capacity=10000, error_rate=0.01):
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, item):
+        # Double hashing: k positions derived from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+    
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class NegativeCache:
+    """Short-lived memory of queries the service reported as unknown locations.
+    
+    A Bloom filter of known-bad queries lets valid queries skip the lookup without
+    taking the lock; a positive is confirmed against the exact, TTL-bound entries, so
+    a valid query is never rejected because of a false positive.
+    """
+    def __init__(self, ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._expiry = OrderedDict()
+        self._bloom = BloomFilter(max_entries)
+        self._added_since_rebuild = 0
+        self._lock = threading.Lock()
+        self.rejections = 0
+    
+    def add(self, key):
+        with self._lock:
+            self._expiry[key] = time.time() + self.ttl
+            self._expiry.move_to_end(key)
+            while len(self._expiry) > self.max_entries:
+                self._expiry.popitem(last=False)
+            self._bloom.add(key)
+            self._added_since_rebuild += 1
+            if self._added_since_rebuild > self.max_entries:
+                # Keep the filter's false positive rate down by rebuilding it from live entries
+                self._rebuild()
+    
+    def _rebuild(self):
+        now = time.time()
+        for key in [key for key, expires_at in self._expiry.items() if expires_at <= now]:
+            del self._expiry[key]
+        self._bloom = BloomFilter(self.max_entries)
+        for key in self._expiry:
+            self._bloom.add(key)
+        self._added_since_rebuild = len(self._expiry)
+    
+    def __contains__(self, key):
+        if key not in self._bloom:
+            return False
+        with self._lock:
+            expires_at = self._expiry.get(key)
+            if expires_at is None:
+                return False
+            if time.time() >= expires_at:
+                del self._expiry[key]
+                return False
+            return True
+    
+    def reject(self, key):
+        """Return True (and count a rejection) if `key` is a recently reported unknown location"""
+        if key not in self:
+            return False
+        with self._lock:
+            self.rejections += 1
+        return True
+    
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._expiry), 'rejections': self.rejections}
+
+# "lat,lon" queries, after whitespace around the comma has been removed
+_COORDINATES = re.compile(r'^(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)$')
+
+def normalize_query(query):
+    """Normalize a location query so equivalent spellings share one key.
+    
+    Case and whitespace are folded, spaces around commas dropped, and coordinates
+    rounded to two decimals (about 1 km), so " London , UK" == "london,uk".
+    """
+    query = re.sub(r'\s*,\s*', ',', " ".join(query.split()).lower())
+    match = _COORDINATES.match(query)
+    if match:
+        return f"{float(match.group(1)):.2f},{float(match.group(2)):.2f}"
+    return query
+
+def canonical_key(location):
+    """Key for the place a query resolved to, built from the response's location block"""
+    return normalize_query(f"{location['name']},{location.get('region', '')},{location['country']}")
+
+class AliasIndex:
+    """Maps normalized query variants to the canonical location they resolved to.
+    
+    Once "london", "london,uk" and "51.51,-0.13" have each been resolved to the same
+    place, they all share one cache entry and one in-flight request.
+    """
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._aliases = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def resolve(self, query_key):
+        """Return the canonical key for a normalized query, or the query itself if unknown"""
+        return self._aliases.get(query_key, query_key)
+    
+    def add(self, query_key, canonical):
+        with self._lock:
+            self._aliases[query_key] = canonical
+            self._aliases.move_to_end(query_key)
+            while len(self._aliases) > self.max_entries:
+                self._aliases.popitem(last=False)
+    
+    def __len__(self):
+        return len(self._aliases)
+
+# Response decoding. With msgspec, only the fields WeatherData needs are decoded,
+# straight into typed structs; everything else in the payload is skipped without
+# building Python objects. Otherwise the payload is parsed into dicts (by orjson if
+# installed) and the fields are picked out of those.
+JSON_DECODERS = [name for name, module in (('msgspec', msgspec), ('orjson', orjson)) if module] + ['json']
+JSON_DECODER = os.environ.get("WEATHER_JSON_DECODER", JSON_DECODERS[0])
+if JSON_DECODER not in JSON_DECODERS:
+    JSON_DECODER = JSON_DECODERS[0]
+
+if msgspec is not None:
+    from typing import List, Optional
+    
+    class _Condition(msgspec.Struct):
+        text: str
+        icon: str = ""
+    
+    class _Location(msgspec.Struct):
+        name: str
+        country: str
+        region: str = ""
+    
+    class _Current(msgspec.Struct):
+        temp_c: float
+        feelslike_c: float
+        humidity: float
+        wind_kph: float
+        last_updated_epoch: int
+        condition: _Condition
+    
+    class _ExtraCurrent(msgspec.Struct):
+        pressure_mb: Optional[float] = None
+        uv: Optional[float] = None
+        gust_kph: Optional[float] = None
+        vis_km: Optional[float] = None
+        precip_mm: Optional[float] = None
+        air_quality: Optional[dict] = None
+    
+    class _Extras(msgspec.Struct):
+        current: Optional[_ExtraCurrent] = None
+    
+    class _Observation(msgspec.Struct):
+        location: _Location
+        current: _Current
+    
+    class _BulkQuery(msgspec.Struct):
+        custom_id: str = ""
+        location: Optional[_Location] = None
+        current: Optional[_Current] = None
+        error: Optional[dict] = None
+    
+    class _BulkId(msgspec.Struct):
+        custom_id: str = ""
+    
+    class _BulkItem(msgspec.Struct):
+        # Kept undecoded so each result's own bytes can be stored as its raw response
+        query: msgspec.Raw
+    
+    class _Bulk(msgspec.Struct):
+        bulk: List[_BulkItem]
+    
+    _observation_decoder = msgspec.json.Decoder(_Observation)
+    _bulk_decoder = msgspec.json.Decoder(_Bulk)
+    _bulk_query_decoder = msgspec.json.Decoder(_BulkQuery)
+    _bulk_id_decoder = msgspec.json.Decoder(_BulkId)
+    _extras_decoder = msgspec.json.Decoder(_Extras)
+
+# Fields WeatherData decodes on demand from the raw response
+EXTRA_FIELDS = ('pressure_mb', 'uv', 'gust_kph', 'vis_km', 'precip_mm', 'air_quality')
+
+def _msgspec_decode(decoder, raw):
+    """Decode with msgspec, raising the errors the stdlib path would"""
+    try:
+        return decoder.decode(raw)
+    except msgspec.ValidationError as err:
+        raise KeyError(f"Missing expected field in API response: {err}")
+    except msgspec.DecodeError as err:
+        raise json.JSONDecodeError(str(err), raw.decode('utf-8', 'replace'), 0)
+
+def _location_key(location):
+    return canonical_key({'name': location.name, 'region': location.region, 'country': location.country})
+
+def _weather_from_struct(location, current, raw=None):
+    icon = current.condition.icon
+    return WeatherData(location.name, location.country, current.temp_c, current.feelslike_c,
+                       current.condition.text, current.humidity, current.wind_kph / 3.6,
+                       current.last_updated_epoch, "https:" + icon if icon else None, raw)
+
+def weather_from_dict(data, raw=None):
+    """Build WeatherData from a parsed current-conditions payload"""
+    try:
+        location = data['location']
+        current = data['current']
+        
+        city = location['name']
+        country = location['country']
+        temp = current['temp_c']
+        feels_like = current['feelslike_c']
+        description = current['condition']['text']
+        humidity = current['humidity']
+        wind_speed = current['wind_kph'] / 3.6  # Convert to m/s
+        timestamp = current['last_updated_epoch']
+        icon = current['condition'].get('icon')
+        icon_url = "https:" + icon if icon else None
+        
+        return WeatherData(
+            city, country, temp, feels_like, description, 
+            humidity, wind_speed, timestamp, icon_url, raw
+        )
+    except KeyError as e:
+        raise KeyError(f"Missing expected field in API response: {e}")
+
+def _loads(raw, decoder):
+    if decoder == 'orjson':
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def decode_observation(raw, decoder=None):
+    """Decode a current-conditions response body into (WeatherData, canonical key)"""
+    decoder = decoder or JSON_DECODER
+    if decoder == 'msgspec':
+        observation = _msgspec_decode(_observation_decoder, raw)
+        location = observation.location
+        return _weather_from_struct(location, observation.current, raw), _location_key(location)
+    data = _loads(raw, decoder)
+    return weather_from_dict(data, raw), canonical_key(data['location'])
+
+def decode_bulk(raw, decoder=None):
+    """Decode a bulk response body.
+    
+    Returns a list of (custom_id, outcome, raw result bytes) where outcome is a
+    (WeatherData, canonical key) pair, a dict describing the service's error for
+    that location, or the KeyError raised for a malformed result.
+    """
+    decoder = decoder or JSON_DECODER
+    results = []
+    if decoder == 'msgspec':
+        for item in _msgspec_decode(_bulk_decoder, raw).bulk:
+            item_raw = bytes(item.query)
+            try:
+                query = _msgspec_decode(_bulk_query_decoder, item_raw)
+            except KeyError as key_err:
+                # Still report the failure against the right location
+                custom_id = _msgspec_decode(_bulk_id_decoder, item_raw).custom_id
+                results.append((custom_id, key_err, item_raw))
+                continue
+            if query.error is not None:
+                outcome = query.error
+            elif query.location is None or query.current is None:
+                missing = 'location' if query.location is None else 'current'
+                outcome = KeyError(f"Missing expected field in API response: '{missing}'")
+            else:
+                location = query.location
+                outcome = _weather_from_struct(location, query.current, item_raw), _location_key(location)
+            results.append((query.custom_id, outcome, item_raw))
+        return results
+    
+    dumps = orjson.dumps if decoder == 'orjson' else (lambda obj: json.dumps(obj).encode())
+    for item in _loads(raw, decoder)['bulk']:
+        query = item['query']
+        item_raw = dumps(query)
+        if 'error' in query:
+            outcome = query['error']
+        else:
+            try:
+                # Each bulk result has the same location/current layout as a single lookup
+                outcome = weather_from_dict(query, item_raw), canonical_key(query['location'])
+            except KeyError as key_err:
+                outcome = key_err
+        results.append((query['custom_id'], outcome, item_raw))
+    return results
+
+def decode_extras(raw, decoder=None):
+    """Decode the EXTRA_FIELDS of a current-conditions (or bulk result) body into a dict.
+    
+    Best effort: fields that are missing or cannot be decoded are left out.
+    """
+    decoder = decoder or JSON_DECODER
+    try:
+        if decoder == 'msgspec':
+            current = _extras_decoder.decode(raw).current
+            if current is None:
+                return {}
+            extras = {name: getattr(current, name) for name in EXTRA_FIELDS}
+        else:
+            current = _loads(bytes(raw), decoder).get('current') or {}
+            extras = {name: current.get(name) for name in EXTRA_FIELDS}
+    except (ValueError, AttributeError):
+        return {}
+    return {name: value for name, value in extras.items() if value is not None}
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single execution"""
     def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def do(self, key, func, *args, timeout=None):
+        """Run func(*args) once per key; concurrent callers share its result or exception.
+        
+        Callers that join an in-flight call wait at most `timeout` seconds for it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+        
+        if not leader:
+            if not call['done'].wait(timeout):
+                raise requests.exceptions.Timeout("Timed out waiting for an identical request in flight")
+        else:
+            try:
+                call['result'] = func(*args)
+            except BaseException as err:
+                call['error'] = err
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call['done'].set()
+        
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+# Time spent opening a new connection (TCP connect plus TLS handshake) on this thread
+_connect_timing = threading.local()
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.monotonic()
+        super().connect()
+        _connect_timing.seconds = time.monotonic() - start
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.monotonic()
+        super().connect()
+        _connect_timing.seconds = time.monotonic() - start
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record how long they took to open"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+class PooledSession:
+    """Long-lived HTTP session that keeps connections alive between requests.
+    
+    Every response gets a `transfer` dict describing the request: body bytes on the
+    wire and after decompression, content encoding, and the connect/TLS handshake
+    time (None when a pooled connection, and its TLS session, was reused).
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, idle_timeout=60.0):
+        # pool_connections: number of hosts to keep a pool for
+        # pool_maxsize: keep-alive connections kept open per host
+        # idle_timeout: seconds without traffic before pooled connections are dropped
+        self.idle_timeout = idle_timeout
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        adapter = _TimedHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._last_used = time.monotonic()
+        self._lock = threading.Lock()
+        
+        # Transfer accounting
+        self.recent_transfers = deque(maxlen=100)
+        self.request_count = 0
+        self.connections_opened = 0
+        self.bytes_on_wire = 0
+        self.bytes_decoded = 0
+        self.handshake_seconds = 0.0
+
+    def _evict_idle_connections(self):
+        """Close pooled connections the server has most likely already dropped"""
+        with self._lock:
+            now = time.monotonic()
+            if self.idle_timeout is not None and now - self._last_used > self.idle_timeout:
+                # Pools are recreated lazily on the next request
+                for adapter in self.session.adapters.values():
+                    adapter.close()
+            self._last_used = now
+
+    def request(self, method, url, **kwargs):
+        """Send a request over the pooled connections"""
+        self._evict_idle_connections()
+        _connect_timing.seconds = None
+        response = self.session.request(method, url, **kwargs)
+        handshake = _connect_timing.seconds
+        
+        # raw.tell() counts body bytes read from the socket, before decompression
+        wire = response.raw.tell() if response.raw is not None else len(response.content)
+        transfer = {
+            'url': urlparse(url)._replace(query="").geturl(),
+            'status': response.status_code,
+            'bytes_on_wire': wire,
+            'bytes_decoded': len(response.content),
+            'encoding': response.headers.get('Content-Encoding', 'identity'),
+            'handshake_seconds': handshake,
+            'elapsed_seconds': response.elapsed.total_seconds(),
+        }
+        response.transfer = transfer
+        with self._lock:
+            self.recent_transfers.append(transfer)
+            self.request_count += 1
+            self.bytes_on_wire += transfer['bytes_on_wire']
+            self.bytes_decoded += transfer['bytes_decoded']
+            if handshake is not None:
+                self.connections_opened += 1
+                self.handshake_seconds += handshake
+        return response
+    
+    def stats(self):
+        """Totals across every request sent through this session"""
+        with self._lock:
+            return {
+                'requests': self.request_count,
+                'connections_opened': self.connections_opened,
+                'handshake_seconds': self.handshake_seconds,
+                'bytes_on_wire': self.bytes_on_wire,
+                'bytes_decoded': self.bytes_decoded,
+            }
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        """Close every pooled connection"""
+        self.session.close()
+
+def _interaction_key(method, url, params=None, body=None, headers=None):
+    """Identify a request for recording/replay; the API key is never part of it.
+    
+    Conditional headers are included, so a recorded 304 is only replayed to a
+    revalidation and never to an unconditional request.
+    """
+    params = {name: value for name, value in (params or {}).items() if name != 'key'}
+    key = [method.upper(), urlparse(url)._replace(query="").geturl(), params, body]
+    conditional = {name.lower(): value for name, value in (headers or {}).items()
+                   if name.lower() in ('if-none-match', 'if-modified-since')}
+    if conditional:
+        key.append(conditional)
+    return json.dumps(key, sort_keys=True)
+
+class RecordingTransport:
+    """Transport that forwards requests to another transport and records every response.
+    
+    The recording (a "cassette") is written to `cassette_path` as JSON on save()/close()
+    and can be served back by ReplayTransport.
+    """
+    def __init__(self, inner, cassette_path):
+        self.inner = inner
+        self.cassette_path = cassette_path
+        self.interactions = []
+        self._lock = threading.Lock()
+    
+    def request(self, method, url, **kwargs):
+        response = self.inner.request(method, url, **kwargs)
+        # Content is stored decoded, so encoding/length headers no longer apply
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        with self._lock:
+            self.interactions.append({
+                'key': _interaction_key(method, url, kwargs.get('params'), kwargs.get('json'),
+                                        kwargs.get('headers')),
+                'status': response.status_code,
+                'headers': headers,
+                'body': base64.b64encode(response.content).decode('ascii'),
+                'elapsed': response.elapsed.total_seconds(),
+            })
+        return response
+    
+    def save(self):
+        """Write everything recorded so far to the cassette file"""
+        with self._lock:
+            with open(self.cassette_path, 'w') as cassette:
+                json.dump({'interactions': self.interactions}, cassette, indent=1)
+    
+    def stats(self):
+        return self.inner.stats()
+    
+    def close(self):
+        self.save()
+        self.inner.close()
+
+class ReplayTransport:
+    """Transport that serves responses from a cassette instead of the network.
+    
+    Each response is delayed by `latency` plus up to `jitter` seconds to simulate the
+    network. Requests recorded several times are replayed in recorded order, cycling.
+    """
+    def __init__(self, cassette_path, latency=0.0, jitter=0.0, seed=None):
+        with open(cassette_path) as cassette:
+            interactions = json.load(cassette)['interactions']
+        self.recorded = {}
+        for interaction in interactions:
+            self.recorded.setdefault(interaction['key'], []).append(interaction)
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._positions = {}
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.misses = 0
+    
+    def request(self, method, url, params=None, json=None, headers=None, **kwargs):
+        key = _interaction_key(method, url, params, json, headers)
+        with self._lock:
+            self.request_count += 1
+            recorded = self.recorded.get(key)
+            if not recorded:
+                self.misses += 1
+                raise requests.exceptions.ConnectionError(f"No recorded response for {method} {url}")
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            interaction = recorded[position % len(recorded)]
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        
+        # Honor the caller's read timeout as the network would
+        timeout = kwargs.get('timeout')
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        if read_timeout is not None and delay > read_timeout:
+            time.sleep(read_timeout)
+            raise requests.exceptions.ReadTimeout(f"Replayed response for {url} exceeded the read timeout")
+        if delay > 0:
+            time.sleep(delay)
+        
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = HTTP_REASONS.get(response.status_code, "")
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = base64.b64decode(interaction['body'])
+        response.url = url
+        response.elapsed = timedelta(seconds=delay)
+        body_size = len(response._content)
+        response.transfer = {
+            'url': url,
+            'status': response.status_code,
+            'bytes_on_wire': body_size,
+            'bytes_decoded': body_size,
+            'encoding': 'identity',
+            'handshake_seconds': None,
+            'elapsed_seconds': delay,
+        }
+        return response
+    
+    def stats(self):
+        with self._lock:
+            return {'requests': self.request_count, 'misses': self.misses}
+    
+    def close(self):
+        pass
+
+def create_transport(pool_connections=10, pool_maxsize=10, idle_timeout=60.0):
+    """Build the transport selected by the WEATHER_TRANSPORT environment variable.
+    
+    "live" (default) talks to the network, "record" also saves responses to the
+    WEATHER_CASSETTE file, and "replay" serves them back from it offline, delayed by
+    WEATHER_REPLAY_LATENCY seconds.
+    """
+    mode = os.environ.get("WEATHER_TRANSPORT", "live").lower()
+    cassette_path = os.environ.get("WEATHER_CASSETTE", "weather_cassette.json")
+    if mode == "replay":
+        return ReplayTransport(cassette_path, float(os.environ.get("WEATHER_REPLAY_LATENCY", 0)))
+    live = PooledSession(pool_connections, pool_maxsize, idle_timeout)
+    if mode == "record":
+        return RecordingTransport(live, cassette_path)
+    return live
+
+def load_watchlist(path=None):
+    """Return the cities to fetch at startup.
+    
+    Read from `path` (or the WEATHER_WATCHLIST_FILE file), one city per line with
+    blank lines and # comments ignored, plus the comma-separated WEATHER_WATCHLIST
+    environment variable. Duplicates are dropped; a missing file is ignored.
+    """
+    cities = []
+    path = path or os.environ.get("WEATHER_WATCHLIST_FILE")
+    if path:
+        try:
+            with open(os.path.expanduser(path), encoding="utf-8") as watchlist_file:
+                cities.extend(line.split("#", 1)[0].strip() for line in watchlist_file)
+        except OSError:
+            pass
+    cities.extend(city.strip() for city in os.environ.get("WEATHER_WATCHLIST", "").split(","))
+    
+    unique = []
+    seen = set()
+    for city in cities:
+        if city and normalize_query(city) not in seen:
+            seen.add(normalize_query(city))
+            unique.append(city)
+    return unique
+
+class WeatherApp:
+    # Maximum number of locations WeatherAPI accepts in one bulk request
+    BULK_LIMIT = 50
+    # Searches listed by show_recent_searches
+    RECENT_SHOWN = 5
+    # Seconds allowed for fetching the startup watchlist
+    WARMUP_BUDGET = 30.0
+    # Seconds allowed for one interactive lookup, including retries
+    LOOKUP_BUDGET = 15.0
+    
+    def __init__(self, pool_connections=10, pool_maxsize=10, idle_timeout=60.0,
+                 connect_timeout=3.05, read_timeout=10.0,
+                 max_attempts=3, failure_threshold=5, reset_timeout=30.0,
+                 rate_limits=None, rate_limit_file=None, rate_limit_mode="wait",
+                 transport=None, cache_size=500, cache_max_ttl=900,
+                 cache_path=None, disk_cache_size=5000, stale_window=600,
+                 negative_ttl=300, memory_budget=None, watchlist=None, history_size=None,
+                 history_path=None, air_quality=None, persistent_cache=True):
         # Get API key from environment variable
         self.api_key = os.environ.get("WEATHER_API_KEY", "")
         if not self.api_key:
             raise ValueError("API key not found. Please set WEATHER_API_KEY in .env file.")
-        self.base_url = "http://api.weatherapi.com/v1/current.json"
-        self.recent_searches = []
+        self.base_url = "https://api.weatherapi.com/v1/current.json"
+        
+        # Ask for air quality readings too (a larger response, decoded only when read)
+        if air_quality is None:
+            air_quality = os.environ.get("WEATHER_AIR_QUALITY", "").lower() in ("1", "true", "yes")
+        self.air_quality = air_quality
+        
+        # Every search this session, oldest overwritten once the store is full
+        if history_size is None:
+            history_size = int(os.environ.get("WEATHER_HISTORY_SIZE", 10000))
+        self.history = HistoryStore(history_size)
+        
+        # Optionally carry the history over between runs, saved in the packed record format
+        self.history_path = history_path or os.environ.get("WEATHER_HISTORY_FILE")
+        if self.history_path and os.path.exists(self.history_path):
+            try:
+                with open(self.history_path, "rb") as history_file:
+                    self.history.extend(history_file.read())
+            except (OSError, ValueError, struct.error):
+                # Unreadable or corrupt history: start a fresh one
+                pass
+        
+        # Reuse connections across lookups instead of reconnecting every time.
+        # Any object with request(method, url, **kwargs), stats() and close() can
+        # stand in for the network (see RecordingTransport and ReplayTransport).
+        if transport is None:
+            transport = create_transport(pool_connections, pool_maxsize, idle_timeout)
+        self.transport = transport
+        
+        # Never wait on the network indefinitely
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        
+        # Retry transient failures, and stop calling a host that keeps failing
+        self.retry_policy = RetryPolicy(max_attempts)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._stats_lock = threading.Lock()
+        self.retry_count = 0
+        self.circuit_rejections = 0
+        
+        # Client-side limit on calls to the weather API (icon downloads are not metered)
+        if rate_limits is None:
+            rate_limits = []
+            per_minute = os.environ.get("WEATHER_RATE_LIMIT_PER_MINUTE")
+            per_month = os.environ.get("WEATHER_RATE_LIMIT_PER_MONTH")
+            if per_minute:
+                rate_limits.append((int(per_minute), 60))
+            if per_month:
+                rate_limits.append((int(per_month), 30 * 24 * 3600))
+        self.rate_limiter = None
+        if rate_limits:
+            # Share one state file per user so every CLI and GUI process draws from the same buckets
+            rate_limit_file = rate_limit_file or os.environ.get("WEATHER_RATE_LIMIT_FILE") or \
+                os.path.join(os.path.expanduser("~"), ".cache", "weather_app", "ratelimit.json")
+            self.rate_limiter = RateLimiter(rate_limits, rate_limit_file, rate_limit_mode)
+        
+        # Identical lookups running at the same time share one upstream request
+        self._inflight = SingleFlight()
+        
+        # Byte budget shared by the in-memory caches (results here, icons in the GUI)
+        if memory_budget is None:
+            memory_budget = int(float(os.environ.get("WEATHER_CACHE_MEMORY_MB", 64)) * 1024 * 1024)
+        self.memory_budget = MemoryBudget(memory_budget)
+        
+        # Recent results keyed by canonical location, kept until the next expected update
+        self.cache = ResultCache(cache_size, max_ttl=cache_max_ttl, budget=self.memory_budget)
+        self.not_modified_count = 0
+        
+        # Query variants already resolved to a canonical location
+        self.aliases = AliasIndex()
+        
+        # Optional on-disk copy of the cache that survives restarts; processes pointed at
+        # the same file share it, reading through to it on a memory miss
+        # (persistent_cache=False keeps this client off disk even if WEATHER_CACHE_DB is set)
+        cache_path = cache_path or os.environ.get("WEATHER_CACHE_DB")
+        # Replayed responses are old recordings and must never reach the shared cache
+        if isinstance(self.transport, ReplayTransport):
+            persistent_cache = False
+        self.disk_cache = None
+        if cache_path and persistent_cache:
+            try:
+                self.disk_cache = DiskCache(cache_path, disk_cache_size)
+            except sqlite3.Error:
+                # Not a usable database (or its directory is missing): run without it
+                pass
+        if self.disk_cache is not None:
+            for query_key, canonical in self.disk_cache.load_aliases():
+                self.aliases.add(query_key, canonical)
+            now = time.time()
+            for key, weather, expires_at, etag, last_modified in self.disk_cache.load():
+                self.cache.put(key, weather, expires_at - now, etag, last_modified)
+    
+        # Interactive lookups may show a result up to stale_window seconds past its
+        # expiry while a background refresh fetches the new one
+        self.stale_window = stale_window
+        self._background = ThreadPoolExecutor(max_workers=4)
+        
+        # Queries recently reported as unknown locations are rejected locally
+        self.negative_cache = NegativeCache(negative_ttl)
+        
+        # Fetch commonly searched cities in the background so first lookups hit the cache
+        if watchlist is None:
+            watchlist = load_watchlist()
+        self.warmed_count = 0
+        self.warmup = self.warm_cache(watchlist) if watchlist else []
+    
+    def _reject_known_bad(self, key):
+        """Raise without contacting the service if `key` was recently reported unknown"""
+        if self.negative_cache.reject(key):
+            raise WeatherServiceError(LOCATION_NOT_FOUND, "No matching location found (cached result)")
+    
+    def _learn_alias(self, query_key, canonical):
+        """Remember which canonical location a normalized query resolved to"""
+        if self.aliases.resolve(query_key) != canonical:
+            self.aliases.add(query_key, canonical)
+            if self.disk_cache is not None:
+                self.disk_cache.put_alias(query_key, canonical)
+    
+    def _load_shared(self, query_key):
+        """Pull a result another process stored in the shared disk cache into memory.
+        
+        Returns the canonical key to look up. A row is copied in when it is fresher than
+        what memory holds, so its data and validators are used instead of a new request.
+        """
+        key = self.aliases.resolve(query_key)
+        if self.disk_cache is None:
+            return key
+        entry = self.cache.peek(key)
+        if entry is not None and entry['expires_at'] > time.time():
+            return key
+        if key == query_key:
+            # Another process may already have resolved this query
+            canonical = self.disk_cache.resolve_alias(query_key)
+            if canonical is not None and canonical != key:
+                self.aliases.add(query_key, canonical)
+                key = canonical
+                entry = self.cache.peek(key)
+                if entry is not None and entry['expires_at'] > time.time():
+                    return key
+        row = self.disk_cache.get(key)
+        if row is not None:
+            weather, expires_at, etag, last_modified = row
+            if entry is None or expires_at > entry['expires_at']:
+                self.cache.put(key, weather, expires_at - time.time(), etag, last_modified)
+        return key
+    
+    def _store_result(self, key, weather, lifetime, raw=None, etag=None, last_modified=None):
+        """Remember a freshly fetched result in memory and, if enabled, on disk"""
+        self.cache.put(key, weather, lifetime, etag, last_modified)
+        # Other processes read the disk cache, so only share results that are still fresh
+        if self.disk_cache is not None and lifetime > 0:
+            self.disk_cache.put(key, weather, raw, time.time() + lifetime, etag, last_modified)
+    
+    def clear_cache(self):
+        """Forget every cached response"""
+        self.cache.clear()
+        if self.disk_cache is not None:
+            self.disk_cache.clear()
+    
+    def save_history(self):
+        """Write the search history to history_path, replacing the file atomically"""
+        if not self.history_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.history_path))
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as history_file:
+                history_file.write(self.history.dumps())
+            os.replace(temp_path, self.history_path)
+        except OSError:
+            # Losing the history is not worth failing shutdown over
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def close(self):
+        """Release network resources held by the app"""
+        self.save_history()
+        self._background.shutdown(wait=False)
+        self.transport.close()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
     
     def display_welcome_banner(self):
         """Display welcome message on screen with formatting"""
@@ -73,31 +1880,396 @@ class WeatherApp:
 """
         print(error_banner)
 
-    def get_weather(self, city):
-        """Fetch weather data for the specified city"""
-        # Display loading message
-        self.display_loading_message(city)
+    def _breaker_for(self, url):
+        """Return the circuit breaker guarding the host of `url`"""
+        host = urlparse(url).netloc
+        with self._stats_lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+            return breaker
+    
+    def _request(self, method, url, deadline=None, **kwargs):
+        """Send a request with timeouts, retries and circuit breaking.
         
+        Connection errors, timeouts and retryable statuses are retried with backoff
+        while attempts and the deadline allow. The last response is returned (or the
+        last error raised) once retrying stops.
+        """
+        breaker = self._breaker_for(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            connect_timeout = self.connect_timeout
+            read_timeout = self.read_timeout
+            if deadline is not None:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    raise requests.exceptions.Timeout("Time budget exhausted before the request was sent")
+                connect_timeout = min(connect_timeout, remaining)
+                read_timeout = min(read_timeout, remaining)
+            
+            # Check the breaker first so a call that will not be sent spends no shared token
+            if not breaker.allow():
+                with self._stats_lock:
+                    self.circuit_rejections += 1
+                raise CircuitOpenError(f"Circuit open for {urlparse(url).netloc}; not contacting the service")
+            
+            if self.rate_limiter is not None and urlparse(url).netloc == urlparse(self.base_url).netloc:
+                try:
+                    self.rate_limiter.acquire(deadline)
+                except RateLimitExceeded:
+                    # Nothing was sent, so release a half-open probe without judging the host
+                    breaker.release_probe()
+                    raise
+            
+            response = None
+            try:
+                response = self.transport.request(method, url, timeout=(connect_timeout, read_timeout), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                breaker.record_failure()
+                if attempt >= self.retry_policy.max_attempts:
+                    raise
+                delay = self.retry_policy.delay_for(attempt)
+                if deadline is not None and delay >= deadline.remaining():
+                    raise
+            except requests.exceptions.RequestException:
+                breaker.record_failure()
+                raise
+            except Exception:
+                # Anything else (e.g. a corrupt cassette) must still settle a half-open probe
+                breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in self.retry_policy.RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                # 429 means we are calling too fast, not that the service is unhealthy
+                if response.status_code == 429:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                if attempt >= self.retry_policy.max_attempts:
+                    return response
+                delay = self.retry_policy.delay_for(attempt, response)
+                if delay is None or (deadline is not None and delay >= deadline.remaining()):
+                    return response
+            
+            with self._stats_lock:
+                self.retry_count += 1
+            time.sleep(delay)
+    
+    def stats(self):
+        """Return counters describing the client's health, for monitoring"""
+        with self._stats_lock:
+            return {
+                'retries': self.retry_count,
+                'circuit_rejections': self.circuit_rejections,
+                'breakers': {host: breaker.state for host, breaker in self._breakers.items()},
+                'rate_limit_waits': self.rate_limiter.waits if self.rate_limiter else 0,
+                'rate_limit_shed': self.rate_limiter.shed if self.rate_limiter else 0,
+                'not_modified': self.not_modified_count,
+                'warmed': self.warmed_count,
+                'cache': self.cache.stats(),
+                'shared_cache': self.disk_cache.stats() if self.disk_cache else None,
+                'memory': self.memory_budget.stats(),
+                'negative_cache': self.negative_cache.stats(),
+                'aliases': len(self.aliases),
+                'transport': self.transport.stats(),
+            }
+    
+    def fetch_weather(self, city, deadline=None):
+        """Fetch weather data for the specified city and return a WeatherData object.
+        
+        Unlike get_weather this does not print anything; errors are raised to the caller.
+        Concurrent calls for the same city wait on a single upstream request, and a
+        cached result is reused until a newer observation is expected (or its
+        Cache-Control/Expires lifetime ends).
+        """
+        query_key = normalize_query(city)
+        self._reject_known_bad(query_key)
+        key = self._load_shared(query_key)
+        weather = self.cache.get(key)
+        if weather is not None:
+            return weather
+        
+        wait_timeout = deadline.remaining() if deadline is not None else None
+        return self._inflight.do(key, self._request_weather, city, deadline,
+                                 timeout=wait_timeout)
+    
+    def fetch_weather_swr(self, city, on_update=None, deadline=None):
+        """Fetch weather using stale-while-revalidate.
+        
+        A cached result up to `stale_window` seconds past its expiry is returned
+        immediately and refreshed in the background; if the refresh brings a newer
+        observation, on_update(new_weather) is called from the background thread.
+        Without a usable cached result this behaves like fetch_weather.
+        """
+        query_key = normalize_query(city)
+        self._reject_known_bad(query_key)
+        key = self._load_shared(query_key)
+        cached = self.cache.get_stale(key, self.stale_window)
+        if cached is None:
+            wait_timeout = deadline.remaining() if deadline is not None else None
+            return self._inflight.do(key, self._request_weather, city, deadline, timeout=wait_timeout)
+        
+        weather, is_stale = cached
+        if is_stale:
+            self._background.submit(self._revalidate, key, city, weather, on_update)
+        return weather
+    
+    def _revalidate(self, key, city, stale_weather, on_update):
+        """Background refresh for fetch_weather_swr"""
+        try:
+            weather = self._inflight.do(key, self._request_weather, city)
+        except Exception:
+            # Keep serving the stale result; the next lookup will try again
+            return
+        if on_update is not None and weather.timestamp > stale_weather.timestamp:
+            on_update(weather)
+    
+    def has_cached(self, city):
+        """Return True if a lookup for `city` can be answered without the network"""
+        query_key = normalize_query(city)
+        if query_key in self.negative_cache:
+            return True
+        entry = self.cache.peek(self._load_shared(query_key))
+        return entry is not None and time.time() - entry['expires_at'] <= self.stale_window
+    
+    def fetch_icon(self, icon_url, deadline=None):
+        """Download a weather condition icon and return its raw bytes"""
+        response = self._request("GET", icon_url, deadline)
+        response.raise_for_status()
+        return response.content
+    
+    def _request_weather(self, city, deadline=None):
+        """Request and parse current weather for one city"""
         params = {
             'q': city,
             'key': self.api_key,
         }
+        if self.air_quality:
+            params['aqi'] = 'yes'
+        
+        # Revalidate a stale cached response instead of downloading it again
+        query_key = normalize_query(city)
+        key = self.aliases.resolve(query_key)
+        entry = self.cache.peek(key)
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        
+        # Network request - potential connection errors
+        response = self._request("GET", self.base_url, deadline, params=params, headers=headers)
+        
+        if response.status_code == 304 and entry is None:
+            # Nothing to revalidate (e.g. the entry was evicted meanwhile): there is no body to use
+            raise requests.exceptions.HTTPError("304 Not Modified without a cached response",
+                                                response=response)
+        if response.status_code == 304:
+            # Unchanged upstream: keep the parsed data and extend its lifetime
+            with self._stats_lock:
+                self.not_modified_count += 1
+            storable, header_lifetime = header_freshness(response.headers)
+            lifetime = self.cache.lifetime_for(entry['weather'], header_lifetime)
+            self.cache.refresh(key, lifetime)
+            if self.disk_cache is not None:
+                self.disk_cache.refresh(key, time.time() + lifetime)
+            return entry['weather']
+        
+        if response.status_code == 400:
+            # WeatherAPI explains bad queries in the body; remember unknown locations
+            try:
+                error = response.json()['error']
+            except (ValueError, KeyError, TypeError):
+                error = None
+            if error is not None:
+                if error.get('code') == LOCATION_NOT_FOUND:
+                    self.negative_cache.add(query_key)
+                raise WeatherServiceError(error.get('code'), error.get('message', 'Unknown error'))
+        
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        
+        # Decode straight into WeatherData - potential parsing errors, or key errors
+        # if the API changes
+        weather_obj, key = decode_observation(response.content)
+        
+        # Every variant of this query now shares the canonical location's cache entry
+        self._learn_alias(query_key, key)
+        
+        storable, header_lifetime = header_freshness(response.headers)
+        if storable:
+            self._store_result(key, weather_obj, self.cache.lifetime_for(weather_obj, header_lifetime),
+                               response.content, response.headers.get('ETag'),
+                               response.headers.get('Last-Modified'))
+        else:
+            self.cache.discard(key)
+        return weather_obj
+    
+    async def get_weather_async(self, city, executor=None, deadline=None):
+        """Fetch weather data for a city without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.fetch_weather, city, deadline)
+    
+    async def gather_weather(self, cities, concurrency=10, budget=None):
+        """Fetch weather for many cities concurrently.
+        
+        At most `concurrency` requests are in flight at once. Returns a dict mapping
+        each city to its WeatherData, or to the exception raised while fetching it.
+        Keep pool_maxsize >= concurrency so every worker can reuse a pooled connection.
+        If `budget` is given, the whole operation is bounded to that many seconds.
+        """
+        deadline = Deadline(budget) if budget is not None else None
+        semaphore = asyncio.Semaphore(concurrency)
+        # Dedicated worker threads so the default executor's size does not cap concurrency
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        
+        async def fetch_one(city):
+            async with semaphore:
+                return await self.get_weather_async(city, executor, deadline)
         
         try:
-            # Network request - potential connection errors
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            
-            # Parse JSON response - potential parsing errors
-            weather_data = response.json()
-            
-            # Process data - potential key errors if API changes
-            weather_obj = self._process_weather_data(weather_data)
+            results = await asyncio.gather(*(fetch_one(city) for city in cities), return_exceptions=True)
+        finally:
+            executor.shutdown(wait=False)
+        return dict(zip(cities, results))
+    
+    def get_weather_many(self, cities, budget=None):
+        """Fetch weather for many cities using WeatherAPI bulk requests.
+        
+        Cities with a fresh cached result are not requested again; the rest are
+        sent in batches of up to BULK_LIMIT locations per call.
+        Returns (results, errors): results maps each city to its WeatherData,
+        errors maps each failed city to the exception describing the failure.
+        If `budget` is given, the whole operation is bounded to that many seconds.
+        """
+        deadline = Deadline(budget) if budget is not None else None
+        results = {}
+        errors = {}
+        # Spellings of the same location share one query: key -> every city variant asking for it
+        missing = OrderedDict()
+        for city in cities:
+            query_key = normalize_query(city)
+            if self.negative_cache.reject(query_key):
+                errors[city] = WeatherServiceError(LOCATION_NOT_FOUND, "No matching location found (cached result)")
+                continue
+            key = self._load_shared(query_key)
+            weather = self.cache.get(key)
+            if weather is not None:
+                results[city] = weather
+            else:
+                missing.setdefault(key, []).append(city)
+        
+        # One query per location, sent as the first spelling seen
+        queries = [variants[0] for variants in missing.values()]
+        variants_of = {variants[0]: variants for variants in missing.values()}
+        for start in range(0, len(queries), self.BULK_LIMIT):
+            batch = queries[start:start + self.BULK_LIMIT]
+            try:
+                batch_results = self._fetch_bulk(batch, deadline)
+            except Exception as err:
+                # The whole call failed, so every city in the batch failed with it
+                batch_results = {city: err for city in batch}
+            for city, outcome in batch_results.items():
+                for variant in variants_of[city]:
+                    if isinstance(outcome, Exception):
+                        errors[variant] = outcome
+                    else:
+                        results[variant] = outcome
+        return results, errors
+    
+    def warm_cache(self, cities, budget=None):
+        """Start fetching `cities` in the background and return the pending futures.
+        
+        Cities that are already cached are skipped; the rest go out in bulk requests
+        of up to BULK_LIMIT locations, run concurrently. Failures are ignored, since
+        a later lookup simply fetches the city itself.
+        """
+        deadline = Deadline(budget if budget is not None else self.WARMUP_BUDGET)
+        missing = []
+        seen = set()
+        for city in cities:
+            query_key = normalize_query(city)
+            if query_key in seen or query_key in self.negative_cache:
+                continue
+            seen.add(query_key)
+            if self.cache.get(self._load_shared(query_key)) is None:
+                missing.append(city)
+        return [self._background.submit(self._warm_batch, missing[start:start + self.BULK_LIMIT], deadline)
+                for start in range(0, len(missing), self.BULK_LIMIT)]
+    
+    def _warm_batch(self, cities, deadline):
+        """Fetch one warm-up batch, falling back to single lookups if bulk calls fail"""
+        try:
+            outcomes = self._fetch_bulk(cities, deadline)
+        except Exception:
+            # e.g. a plan without bulk requests
+            outcomes = {}
+            for city in cities:
+                try:
+                    outcomes[city] = self.fetch_weather(city, deadline)
+                except Exception as err:
+                    outcomes[city] = err
+        warmed = sum(1 for outcome in outcomes.values() if not isinstance(outcome, Exception))
+        with self._stats_lock:
+            self.warmed_count += warmed
+        return warmed
+    
+    def _fetch_bulk(self, cities, deadline=None):
+        """Send one bulk request and return a dict of city -> WeatherData or exception"""
+        params = {
+            'q': 'bulk',
+            'key': self.api_key,
+        }
+        if self.air_quality:
+            params['aqi'] = 'yes'
+        # custom_id lets us match each result back to its query
+        body = {
+            'locations': [{'q': city, 'custom_id': str(i)} for i, city in enumerate(cities)]
+        }
+        
+        response = self._request("POST", self.base_url, deadline, params=params, json=body)
+        response.raise_for_status()
+        
+        outcomes = {}
+        for custom_id, outcome, raw in decode_bulk(response.content):
+            city = cities[int(custom_id)]
+            if isinstance(outcome, dict):
+                if outcome.get('code') == LOCATION_NOT_FOUND:
+                    self.negative_cache.add(normalize_query(city))
+                outcomes[city] = WeatherServiceError(outcome.get('code'), outcome.get('message', 'Unknown error'))
+                continue
+            if isinstance(outcome, KeyError):
+                outcomes[city] = outcome
+                continue
+            weather_obj, key = outcome
+            outcomes[city] = weather_obj
+            self._learn_alias(normalize_query(city), key)
+            self._store_result(key, weather_obj, self.cache.lifetime_for(weather_obj), raw)
+        
+        # Any location the service silently dropped is reported as missing
+        for city in cities:
+            if city not in outcomes:
+                outcomes[city] = KeyError(f"No result returned for '{city}'")
+        return outcomes
+    
+    def get_weather(self, city):
+        """Fetch weather data for the specified city"""
+        # Display loading message, unless the answer is already cached
+        if not self.has_cached(city):
+            self.display_loading_message(city)
+        
+        try:
+            # Serve cached data at once; newer data found in the background is printed when it arrives
+            weather_obj = self.fetch_weather_swr(city, on_update=self.display_weather_update,
+                                                 deadline=Deadline(self.LOOKUP_BUDGET))
             
-            # Store in recent searches
-            self.recent_searches.append(weather_obj)
-            if len(self.recent_searches) > 5:
-                self.recent_searches.pop(0)
+            # Store in search history
+            self.history.append(weather_obj)
                 
             # Return formatted weather data
             return str(weather_obj)
@@ -109,11 +2281,23 @@ class WeatherApp:
             self.display_error_message("TIMEOUT", "Request timed out. The weather service may be experiencing high traffic.")
             return None
         except requests.exceptions.HTTPError as http_err:
-            if response.status_code == 400:
+            if http_err.response is not None and http_err.response.status_code == 400:
                 self.display_error_message("SEARCH", f"City '{city}' not found. Please check the spelling and try again.")
             else:
                 self.display_error_message("HTTP", f"Weather service returned an error: {http_err}")
             return None
+        except WeatherServiceError as api_err:
+            if api_err.code == LOCATION_NOT_FOUND:
+                self.display_error_message("SEARCH", f"City '{city}' not found. Please check the spelling and try again.")
+            else:
+                self.display_error_message("SEARCH", f"Weather service could not handle '{city}': {api_err.message}")
+            return None
+        except CircuitOpenError:
+            self.display_error_message("SERVICE", "The weather service is temporarily unavailable. Please try again shortly.")
+            return None
+        except RateLimitExceeded:
+            self.display_error_message("RATE LIMIT", "Too many requests. Please wait a moment and try again.")
+            return None
         except json.JSONDecodeError:
             self.display_error_message("DATA", "Received invalid data from the weather service.")
             return None
@@ -124,36 +2308,20 @@ class WeatherApp:
             self.display_error_message("UNEXPECTED", f"An unexpected error occurred: {err}")
             return None
     
-    def _process_weather_data(self, data):
-        """Process the weather API response into a WeatherData object"""
-        try:
-            location = data['location']
-            current = data['current']
-            
-            city = location['name']
-            country = location['country']
-            temp = current['temp_c']
-            feels_like = current['feelslike_c']
-            description = current['condition']['text']
-            humidity = current['humidity']
-            wind_speed = current['wind_kph'] / 3.6  # Convert to m/s
-            timestamp = current['last_updated_epoch']
-            
-            return WeatherData(
-                city, country, temp, feels_like, description, 
-                humidity, wind_speed, timestamp
-            )
-        except KeyError as e:
-            raise KeyError(f"Missing expected field in API response: {e}")
+    def display_weather_update(self, weather):
+        """Print newer weather data that arrived after a cached result was shown"""
+        print(f"\n\n[Update] Newer weather data arrived for {weather.city}:")
+        print(weather)
+        print("\nEnter city name: ", end="", flush=True)
     
     def show_recent_searches(self):
         """Display recent searches"""
-        if not self.recent_searches:
+        if not self.history:
             print("\nNo recent searches.")
             return
         
         print("\n===== RECENT SEARCHES =====")
-        for i, weather in enumerate(reversed(self.recent_searches), 1):
+        for i, weather in enumerate(self.history.recent(self.RECENT_SHOWN), 1):
             print(f"{i}. {weather.city}, {weather.country}: {weather.temperature}°C, {weather.description}")
         print("===========================")
 
@@ -202,6 +2370,8 @@ def main():
             # Catch any unexpected exceptions we didn't handle specifically
             print(f"\nAn unexpected error occurred: {e}")
             print("Please try again.")
+    
+    app.close()
 
 if __name__ == "__main__":
     main()
@@ -3,41 +3,252 @@ from tkinter import ttk, messagebox, scrolledtext
 import requests
 import json
 from datetime import datetime
-from PIL import Image, ImageTk
+from PIL import Image
 import io
 import os
+import queue
+import threading
+import base64
+import hashlib
+import mmap
+import re
+import struct
+from collections import OrderedDict
 from dotenv import load_dotenv
+from weather_app import (WeatherApp, Deadline, CircuitOpenError, RateLimitExceeded, WeatherServiceError,
+                         LOCATION_NOT_FOUND, normalize_query)
 
 # Load environment variables from .env file
 load_dotenv()
 
-class WeatherData:
-    """Class to store and represent weather data"""
-    def __init__(self, city, country, temp, feels_like, description, humidity, wind_speed, timestamp, icon_url=None):
-        self.city = city
-        self.country = country
-        self.temperature = temp
-        self.feels_like = feels_like
-        self.description = description
-        self.humidity = humidity
-        self.wind_speed = wind_speed
-        self.timestamp = timestamp
-        self.icon_url = icon_url
-        
-    def __str__(self):
-        """String representation of the weather data"""
-        date_time = datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        
-        return f"""
-Weather in {self.city}, {self.country} at {date_time}:
-Temperature: {self.temperature}°C (Feels like: {self.feels_like}°C)
-Conditions: {self.description}
-Humidity: {self.humidity}%
-Wind Speed: {self.wind_speed:.1f} m/s
-"""
+class IconAtlas:
+    """Read-only, memory-mapped file holding every condition icon pre-resized as PNG.
+    
+    Layout: MAGIC, a little-endian uint32 index length, a JSON index mapping
+    "day/113@100x100" style keys to [offset, length], then the PNG blobs.
+    Built by build_icon_atlas.py.
+    """
+    MAGIC = b"WXICONS1"
+    _HEADER = struct.Struct("<8sI")
+    # Icon URLs look like //cdn.weatherapi.com/weather/64x64/day/113.png
+    _ICON_URL = re.compile(r"/(day|night)/(\d+)\.png$")
+    
+    def __init__(self, path):
+        with open(path, "rb") as atlas_file:
+            self._map = mmap.mmap(atlas_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.index = self._read_index(path)
+        except ValueError:
+            self._map.close()
+            raise
+    
+    def _read_index(self, path):
+        """Check the header and return the index; raise ValueError if the file is not an atlas"""
+        if len(self._map) < self._HEADER.size:
+            raise ValueError(f"{path} is too short to be an icon atlas")
+        magic, index_length = self._HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not an icon atlas")
+        start = self._HEADER.size
+        if len(self._map) < start + index_length:
+            raise ValueError(f"{path} is truncated")
+        # JSON and UTF-8 decoding errors are ValueErrors too
+        index = json.loads(self._map[start:start + index_length].decode("utf-8"))
+        if not isinstance(index, dict):
+            raise ValueError(f"{path} has a corrupt index")
+        return index
+    
+    @classmethod
+    def key(cls, time_of_day, code, size):
+        return f"{time_of_day}/{code}@{size[0]}x{size[1]}"
+    
+    @classmethod
+    def key_for_url(cls, url, size):
+        """Atlas key for an icon URL, or None if the URL is not a standard condition icon"""
+        match = cls._ICON_URL.search(url)
+        return cls.key(match.group(1), match.group(2), size) if match else None
+    
+    def get(self, url, size):
+        """Return the PNG bytes for an icon URL at `size`, or None if the atlas lacks it"""
+        key = self.key_for_url(url, size)
+        entry = self.index.get(key) if key else None
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._map[offset:offset + length]
+    
+    def close(self):
+        self._map.close()
+    
+    @classmethod
+    def write(cls, path, icons):
+        """Write an atlas file from a dict of atlas key -> PNG bytes"""
+        # Offsets depend on the index length, which depends on the offsets: size the
+        # index with placeholder offsets first, then pad it to that length
+        placeholder = json.dumps({key: [0xFFFFFFFF, len(data)] for key, data in icons.items()})
+        data_start = cls._HEADER.size + len(placeholder)
+        index = {}
+        offset = data_start
+        for key, data in icons.items():
+            index[key] = [offset, len(data)]
+            offset += len(data)
+        index_bytes = json.dumps(index).encode("utf-8").ljust(len(placeholder), b" ")
+        # Write then rename so a GUI starting meanwhile never maps a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as atlas_file:
+                atlas_file.write(cls._HEADER.pack(cls.MAGIC, len(index_bytes)))
+                atlas_file.write(index_bytes)
+                for data in icons.values():
+                    atlas_file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+def open_icon_atlas(path=None):
+    """Open the icon atlas at `path` (or WEATHER_ICON_ATLAS), or return None if there is none"""
+    path = path or os.environ.get("WEATHER_ICON_ATLAS") or \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "weather_icons.atlas")
+    try:
+        return IconAtlas(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+class IconCache:
+    """Cache of condition icons.
+    
+    Decoded, resized PhotoImages are kept in memory, counted against the client's
+    memory budget. Below that, icons come from the prebuilt atlas when one is
+    available, else from resized PNG bytes kept on disk (keyed by URL and target size)
+    so later runs skip both the download and the resize.
+    
+    The budget may evict icons from any thread, but Tk images must only be deleted
+    on the Tk thread: evicted images are parked until release_evicted() runs there.
+    """
+    name = "icons"
+    
+    def __init__(self, client, cache_dir=None, max_images=64, atlas=None):
+        self.client = client
+        self.atlas = atlas
+        self.budget = client.memory_budget
+        self.budget.register(self)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {'capacity': 0, 'budget': 0}
+        self.cache_dir = cache_dir or os.environ.get("WEATHER_ICON_CACHE_DIR") or \
+            os.path.join(os.path.expanduser("~"), ".cache", "weather_app", "icons")
+        self.max_images = max_images
+        self._images = OrderedDict()
+        self._evicted = []
+        self._lock = threading.Lock()
+    
+    def _path(self, url, size):
+        digest = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}_{size[0]}x{size[1]}.png")
+    
+    def get(self, url, size, deadline=None):
+        """Return a PhotoImage of the icon at `url` resized to `size`"""
+        key = (url, size)
+        with self._lock:
+            cached = self._images.get(key)
+            if cached is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        
+        png_bytes = self.atlas.get(url, size) if self.atlas is not None else None
+        if png_bytes is None:
+            path = self._path(url, size)
+            try:
+                with open(path, "rb") as icon_file:
+                    png_bytes = icon_file.read()
+            except OSError:
+                png_bytes = self._download(url, size, deadline)
+                self._save(path, png_bytes)
+        
+        # Tk decodes PNG data natively
+        photo = tk.PhotoImage(data=base64.b64encode(png_bytes).decode("ascii"), format="png")
+        # Tk stores photo images at 4 bytes per pixel
+        nbytes = size[0] * size[1] * 4
+        with self._lock:
+            self._images[key] = (photo, nbytes)
+            self.bytes += nbytes
+            self.budget.charge(nbytes)
+            while len(self._images) > self.max_images:
+                self._evict_oldest('capacity')
+        self.budget.reclaim(self)
+        self.release_evicted()
+        return photo
+    
+    def _evict_oldest(self, reason):
+        """Park the least recently used image for release; caller holds the lock"""
+        key, (photo, nbytes) = self._images.popitem(last=False)
+        self._evicted.append(photo)
+        self.bytes -= nbytes
+        self.budget.release(nbytes)
+        self.evictions[reason] += 1
+    
+    def evict_one(self, reason):
+        """Evict the least recently used image; return False if there is none (any thread)"""
+        with self._lock:
+            if not self._images:
+                return False
+            self._evict_oldest(reason)
+            return True
+    
+    def release_evicted(self):
+        """Drop the last references to evicted images (call on the Tk thread)"""
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+        del evicted
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._images),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': dict(self.evictions),
+            }
+    
+    def _download(self, url, size, deadline):
+        """Fetch an icon and return it resized, as PNG bytes"""
+        icon_image = Image.open(io.BytesIO(self.client.fetch_icon(url, deadline)))
+        icon_image = icon_image.resize(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        icon_image.save(buffer, format="PNG")
+        return buffer.getvalue()
+    
+    def _save(self, path, png_bytes):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write then rename so other processes never read a partial file
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as icon_file:
+                icon_file.write(png_bytes)
+            os.replace(temp_path, path)
+        except OSError:
+            # The disk cache is only an optimization
+            pass
 
 class WeatherAppGUI:
-    def __init__(self, root):
+    # Seconds a single search may spend on the network, icon download included
+    LOOKUP_BUDGET = 15.0
+    # How often (ms) to check for background refreshes of the displayed city
+    UPDATE_POLL_MS = 250
+    # Size the condition icon is displayed at
+    ICON_SIZE = (100, 100)
+    # Searches listed in the history window
+    HISTORY_SHOWN = 50
+    
+    def __init__(self, root, watchlist=None):
         self.root = root
         self.root.title("Weather App")
         # Further increase window size to ensure all information is visible
@@ -45,6 +256,8 @@ class WeatherAppGUI:
         self.root.resizable(True, True)
         self.root.configure(bg="#f0f0f0")
         
+        self.client = None
+        
         # Get API key from environment variable
         self.api_key = os.environ.get("WEATHER_API_KEY", "")
         if not self.api_key:
@@ -53,12 +266,23 @@ class WeatherAppGUI:
             self.root.quit()
             return
             
-        self.base_url = "http://api.weatherapi.com/v1/current.json"
+        # Weather client shared by lookups and icon downloads
+        # (pooled connections, timeouts); it starts fetching the watchlist right away
+        self.client = WeatherApp(watchlist=watchlist)
+        
+        # Icons come from the prebuilt atlas when present and are cached so repeat
+        # conditions render without network or image work
+        self.icons = IconCache(self.client, atlas=open_icon_atlas())
+        
+        # Newer data from background refreshes, handed to the Tk thread through a queue
+        self.updates = queue.Queue()
+        self.displayed_query = None
         
-        # Store recent searches
-        self.recent_searches = []
+        # Search history lives in the client's columnar store
+        self.history = self.client.history
         
         self.setup_ui()
+        self.root.after(self.UPDATE_POLL_MS, self.process_updates)
     
     def setup_ui(self):
         # Create a frame for the search section
@@ -129,38 +353,33 @@ Click 'History' to view your recent searches.
         for widget in self.weather_frame.winfo_children():
             widget.destroy()
         
+        # Only this query's background refreshes should redraw the display
+        query = normalize_query(city)
+        self.displayed_query = query
+        
         # Show loading message
         self.display_status_message(f"Fetching weather data for {city}...")
         loading_label = tk.Label(self.weather_frame, text="Loading...", font=("Arial", 14), bg="#f0f0f0")
         loading_label.pack(pady=100)
         self.root.update()
         
-        params = {
-            'q': city,
-            'key': self.api_key,
-        }
+        # Bound the whole search so a stalled service cannot freeze the window
+        deadline = Deadline(self.LOOKUP_BUDGET)
         
         try:
-            # Network request - potential connection errors
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
-            
-            # Parse JSON response - potential parsing errors
-            data = response.json()
+            # Network request, parsing and processing - potential connection, data and key errors.
+            # Cached data is shown at once and redrawn if a background refresh finds newer data.
+            weather_obj = self.client.fetch_weather_swr(
+                city, on_update=lambda weather: self.updates.put((query, weather)), deadline=deadline)
             
-            # Process data - potential key errors
-            weather_obj = self._process_weather_data(data)
-            
-            # Add to recent searches
-            self.recent_searches.append(weather_obj)
-            if len(self.recent_searches) > 5:
-                self.recent_searches.pop(0)
+            # Add to search history
+            self.history.append(weather_obj)
             
             # Clear loading message
             loading_label.destroy()
             
             # Display weather data
-            self.display_weather_data(weather_obj)
+            self.display_weather_data(weather_obj, deadline)
             self.display_status_message(f"Displaying weather for {city}")
             
         except requests.exceptions.ConnectionError:
@@ -171,11 +390,24 @@ Click 'History' to view your recent searches.
             self.display_error("TIMEOUT ERROR", "Request timed out.\nThe weather service may be experiencing high traffic.")
         except requests.exceptions.HTTPError as http_err:
             loading_label.destroy()
-            if response.status_code == 400:
+            if http_err.response is not None and http_err.response.status_code == 400:
                 error_msg = f"City '{city}' not found.\nPlease check the spelling and try again."
             else:
                 error_msg = f"Weather service returned an error:\n{http_err}"
             self.display_error("SEARCH ERROR", error_msg)
+        except WeatherServiceError as api_err:
+            loading_label.destroy()
+            if api_err.code == LOCATION_NOT_FOUND:
+                error_msg = f"City '{city}' not found.\nPlease check the spelling and try again."
+            else:
+                error_msg = f"Weather service could not handle '{city}':\n{api_err.message}"
+            self.display_error("SEARCH ERROR", error_msg)
+        except CircuitOpenError:
+            loading_label.destroy()
+            self.display_error("SERVICE ERROR", "The weather service is temporarily unavailable.\nPlease try again shortly.")
+        except RateLimitExceeded:
+            loading_label.destroy()
+            self.display_error("RATE LIMIT ERROR", "Too many requests.\nPlease wait a moment and try again.")
         except json.JSONDecodeError:
             loading_label.destroy()
             self.display_error("DATA ERROR", "Received invalid data from the weather service.")
@@ -186,30 +418,22 @@ Click 'History' to view your recent searches.
             loading_label.destroy()
             self.display_error("UNEXPECTED ERROR", f"An unexpected error occurred:\n{err}")
     
-    def _process_weather_data(self, data):
-        """Process the weather API response into a WeatherData object"""
+    def process_updates(self):
+        """Redraw the display with newer data from background refreshes (runs on the Tk thread)"""
         try:
-            location = data['location']
-            current = data['current']
-            
-            city = location['name']
-            country = location['country']
-            temp = current['temp_c']
-            feels_like = current['feelslike_c']
-            description = current['condition']['text']
-            humidity = current['humidity']
-            wind_speed = current['wind_kph'] / 3.6  # Convert to m/s
-            timestamp = current['last_updated_epoch']
-            icon_url = "https:" + current['condition']['icon']
-            
-            return WeatherData(
-                city, country, temp, feels_like, description, 
-                humidity, wind_speed, timestamp, icon_url
-            )
-        except KeyError as e:
-            raise KeyError(f"Missing field in API response: {e}")
+            while True:
+                query, weather = self.updates.get_nowait()
+                if query == self.displayed_query:
+                    # Runs on the Tk thread, so an icon download must not block it unbounded
+                    self.display_weather_data(weather, Deadline(self.LOOKUP_BUDGET))
+                    self.display_status_message(f"Updated weather for {weather.city}")
+        except queue.Empty:
+            pass
+        # Icons evicted by background threads are deleted here, on the Tk thread
+        self.icons.release_evicted()
+        self.root.after(self.UPDATE_POLL_MS, self.process_updates)
     
-    def display_weather_data(self, weather_data):
+    def display_weather_data(self, weather_data, deadline=None):
         # Clear any existing frames in the weather frame
         for widget in self.weather_frame.winfo_children():
             widget.destroy()
@@ -252,11 +476,8 @@ Click 'History' to view your recent searches.
         # Try to get weather icon
         if weather_data.icon_url:
             try:
-                icon_response = requests.get(weather_data.icon_url)
-                icon_image = Image.open(io.BytesIO(icon_response.content))
-                # Make icon larger
-                icon_image = icon_image.resize((100, 100), Image.LANCZOS)
-                icon_photo = ImageTk.PhotoImage(icon_image)
+                # Larger than the downloaded icon
+                icon_photo = self.icons.get(weather_data.icon_url, self.ICON_SIZE, deadline)
                 icon_label = tk.Label(info_frame, image=icon_photo, bg="white")
                 icon_label.image = icon_photo  # Keep a reference
                 icon_label.pack(pady=(0, 10))
@@ -307,6 +528,24 @@ Click 'History' to view your recent searches.
         tk.Label(details_frame, text=f"{weather_data.wind_speed:.1f} m/s", font=("Arial", 14, "bold"), 
                 bg="white").grid(row=2, column=1, sticky="w", pady=8)
         
+        # Extra readings, decoded from the raw response only now that they are shown
+        extras = [
+            ("Wind Gusts:", weather_data.gust_speed, "{:.1f} m/s"),
+            ("Pressure:", weather_data.pressure, "{:.0f} mb"),
+            ("Visibility:", weather_data.visibility, "{:.0f} km"),
+            ("Precipitation:", weather_data.precipitation, "{:.1f} mm"),
+            ("UV Index:", weather_data.uv, "{:.0f}"),
+        ]
+        row = 3
+        for label, value, value_format in extras:
+            if value is None:
+                continue
+            tk.Label(details_frame, text=label, font=("Arial", 14), 
+                    bg="white").grid(row=row, column=0, sticky="w", padx=10, pady=8)
+            tk.Label(details_frame, text=value_format.format(value), font=("Arial", 14, "bold"), 
+                    bg="white").grid(row=row, column=1, sticky="w", pady=8)
+            row += 1
+        
         # Add extra padding at the bottom
         tk.Label(info_frame, text="", bg="white").pack(pady=20)
         
@@ -329,7 +568,7 @@ Click 'History' to view your recent searches.
     
     def show_history(self):
         """Show recent search history"""
-        if not self.recent_searches:
+        if not self.history:
             messagebox.showinfo("History", "No recent searches.")
             return
         
@@ -356,7 +595,7 @@ Click 'History' to view your recent searches.
         history_text.pack(fill="both", expand=True)
         
         # Insert history items
-        for i, weather in enumerate(reversed(self.recent_searches), 1):
+        for i, weather in enumerate(self.history.recent(self.HISTORY_SHOWN), 1):
             date_time = datetime.fromtimestamp(weather.timestamp).strftime('%Y-%m-%d %H:%M')
             history_text.insert(tk.END, f"{i}. {date_time} - {weather.city}, {weather.country}: {weather.temperature}°C, {weather.description}\n\n")
         
@@ -390,6 +629,8 @@ def main():
             pass
             
         root.mainloop()
+        if app.client:
+            app.client.close()
     except Exception as e:
         messagebox.showerror("Application Error", f"An unexpected error occurred: {e}")
 